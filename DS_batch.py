@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""This module renders maps without the user interface, i.e., for batch jobs
+on machines without a display.
+
+Phase portraits of standard maps are calculated from the given seeds and
+image maps are iterated, and the results are written as PNG images, NumPy
+arrays or, for image maps, animated GIF or PNG files. Qt is never imported.
+
+Examples:
+    python3 DS_batch.py standard_map.json --set K=0.97 --grid 20 --steps 5000
+    python3 DS_batch.py arnold_cat.json --iterations 100 --every 10
+    python3 DS_batch.py arnold_cat.json --iterations 300 --format gif --fps 25
+    python3 DS_batch.py standard_map.json --sweep K=0:2:41 --grid 10
+"""
+
+import sys
+
+# Make sure that nothing below pulls in PyQt5 or the Qt backend of matplotlib
+sys.modules['PyQt5'] = None
+
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from src.export import exportFrames
+from src.loader import loadMap
+from src.render import DensityRaster
+from src.sweep import sweep, parseRange
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(
+        description='Render maps from json files without the user interface.')
+    parser.add_argument('map', help='json file of the map')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='NAME=VALUE', dest='constants',
+                        help='value of a constant, can be repeated')
+    parser.add_argument('--seed', action='append', default=[],
+                        metavar='Q,P', dest='seeds',
+                        help='initial values of an orbit, can be repeated')
+    parser.add_argument('--grid', type=int, default=0, metavar='N',
+                        help='add a grid of N*N seeds over the phase space')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='number of points per orbit')
+    parser.add_argument('--bins', type=int, default=1024,
+                        help='resolution of the phase portrait image')
+    parser.add_argument('--iterations', type=int, default=1,
+                        help='number of image map iterations')
+    parser.add_argument('--every', type=int, default=1, metavar='N',
+                        help='write every N-th iteration of an image map')
+    parser.add_argument('--size', type=int, default=None,
+                        help='resize the image of an image map')
+    parser.add_argument('--backend', default=None,
+                        help='calculation backend, numpy or numba')
+    parser.add_argument('--float32', action='store_true',
+                        help='store the orbits of standard maps in float32, '
+                             'which halves their memory')
+    parser.add_argument('--sweep', action='append', default=[],
+                        metavar='NAME=START:STOP:NUM', dest='sweeps',
+                        help='sweep a constant over NUM values, can be '
+                             'repeated for a grid')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes for sweeps or threads for '
+                             'encoding frames')
+    parser.add_argument('--format', choices=('png', 'npy', 'gif', 'apng'),
+                        default='png',
+                        help='output format, gif and apng write one animation '
+                             'of an image map')
+    parser.add_argument('--fps', type=float, default=10,
+                        help='frames per second of animations')
+    parser.add_argument('--output', default='output',
+                        help='output directory')
+    return parser.parse_args(argv)
+
+
+def setConstants(m, constants):
+    for item in constants:
+        name, value = item.split('=', 1)
+        if name not in m.constants:
+            raise SystemExit('Unknown constant %s, the map has %s'
+                             % (name, ', '.join(m.constants)))
+        m.values[name] = float(value)
+
+
+def portraitImage(raster):
+    """Converts the density raster to a grayscale image with logarithmic
+    scaling, dark points on white background and p pointing up.
+    """
+    density = np.log1p(raster.counts)
+    density /= max(density.max(), 1.0)
+    pixels = np.round(255 * (1.0 - density)).astype(np.uint8)
+    return Image.fromarray(np.flipud(pixels))
+
+
+def getSeeds(m, args):
+    seeds = [tuple(float(v) for v in seed.split(',')) for seed in args.seeds]
+    q0 = [q for q, p in seeds]
+    p0 = [p for q, p in seeds]
+    if args.grid:
+        gridQ, gridP = m.seedGrid(args.grid)
+        q0.extend(gridQ)
+        p0.extend(gridP)
+    if not q0:
+        raise SystemExit('No seeds given, use --seed or --grid')
+    return q0, p0
+
+
+def renderSweep(m, args):
+    """Writes sweep.npy with the density rasters (png format) or the orbits
+    (npy format) of every parameter point and sweep.json with the points.
+    """
+    q0, p0 = getSeeds(m, args)
+    ranges = dict(parseRange(item) for item in args.constants)
+    ranges.update(parseRange(item) for item in args.sweeps)
+    bins = args.bins if args.format == 'png' else None
+
+    def progress(done, total):
+        logging.info('Sweep progress: %d/%d', done, total)
+
+    cancel = threading.Event()
+    try:
+        points, _ = sweep(args.map, ranges, q0, p0, args.steps, bins,
+                          args.workers, args.backend,
+                          os.path.join(args.output, 'sweep.npy'),
+                          progress, cancel,
+                          'float32' if args.float32 else None)
+    except KeyboardInterrupt:
+        cancel.set()
+        raise SystemExit('Sweep cancelled')
+
+    points = [{k: float(v) for k, v in p.items()} for p in points]
+    with open(os.path.join(args.output, 'sweep.json'), 'w') as f:
+        json.dump(points, f, indent=4)
+
+
+def renderStandard(m, args):
+    q0, p0 = getSeeds(m, args)
+
+    logging.info('Calculating %d orbits', len(q0))
+    q, p = m.mapBatch(q0, p0, args.steps)
+
+    if args.format == 'npy':
+        np.save(os.path.join(args.output, 'q.npy'), q)
+        np.save(os.path.join(args.output, 'p.npy'), p)
+        return
+
+    raster = DensityRaster(m.mod, args.bins)
+    raster.add(q, p)
+    portraitImage(raster).save(os.path.join(args.output, 'portrait.png'))
+
+
+def renderImage(m, args):
+    if args.size is not None:
+        m.resize(args.size)
+
+    if args.format == 'npy':
+        # Every frame is written before the next one is calculated
+        for iteration, img in m.frames(args.iterations, args.every, True):
+            np.save(os.path.join(args.output, 'frame_%06d.npy' % iteration),
+                    img)
+        return
+
+    output = args.output
+    if args.format == 'gif':
+        output = os.path.join(args.output, 'animation.gif')
+    elif args.format == 'apng':
+        output = os.path.join(args.output, 'animation.png')
+
+    def progress(done, total):
+        logging.info('Export progress: %d/%d', done, total)
+
+    count = math.ceil(args.iterations / args.every) + 1
+    exportFrames(m.frames(args.iterations, args.every), output, args.format,
+                 args.fps, count, args.workers, progress=progress)
+
+
+def main(argv=None):
+    args = parseArguments(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s: %(message)s')
+
+    m = loadMap(args.map)
+    if m is None:
+        raise SystemExit('Could not load map from %s' % args.map)
+    if args.backend is not None:
+        m.setBackend(args.backend)
+    if args.float32 and m.type == 'standard':
+        m.setDtype('float32')
+    setConstants(m, args.constants)
+
+    os.makedirs(args.output, exist_ok=True)
+    if args.sweeps:
+        renderSweep(m, args)
+    elif m.type == 'standard':
+        if args.format not in ('png', 'npy'):
+            raise SystemExit('Standard maps can only be written as png or npy')
+        renderStandard(m, args)
+    else:
+        renderImage(m, args)
+    logging.info('Results written to %s', args.output)
+
+
+if __name__ == '__main__':
+    main()
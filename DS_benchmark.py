@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+"""This module benchmarks the calculations of the maps and the drawing of the
+tabs, so changes can be checked for speedups and slowdowns.
+
+Every case is run until it took at least --min-time seconds in total and the
+fastest run is reported, together with the throughput, e.g., pixels per
+second. The results can be written to a json file and compared against a
+baseline from an earlier run, in which case every case that got slower than
+the threshold is reported as regression and the exit code is 1.
+
+The drawing cases use the offscreen platform of Qt unless QT_QPA_PLATFORM is
+set, so no display is needed.
+
+Examples:
+    python3 DS_benchmark.py --output baseline.json
+    python3 DS_benchmark.py --baseline baseline.json --threshold 0.1
+    python3 DS_benchmark.py --quick --only gather resize
+"""
+
+import os
+import sys
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import argparse
+import json
+import logging
+import platform
+import tempfile
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+
+from src import backends, store
+from src.loader import loadMap
+from src.maps import DTYPES, RESIZE_FILTERS, ImageMap
+from src.orbit_cache import CACHE_BYTES
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+GATHER_SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+QUICK_SIZES = (64, 256, 1024)
+
+GROUPS = OrderedDict()
+
+
+def group(function):
+    """Registers a benchmark group. The function yields the cases of the
+    group as (name, run, work, unit), where run is called without arguments
+    and work is the number of units it processes per call.
+    """
+    GROUPS[function.__name__] = function
+    return function
+
+
+def loadExample(fileName, cacheDir):
+    """Loads one of the example maps without decoding its image. Images
+    that are decoded anyway are cached in cacheDir.
+    """
+    m = loadMap(os.path.join(ROOT, fileName), lazy=True)
+    if isinstance(m, ImageMap):
+        m.cacheDir = cacheDir
+    return m
+
+
+def randomImage(size):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+
+
+def measure(run, minTime):
+    """Returns the fastest of at least three runs, after one warm up run.
+    """
+    run()
+    best = float('inf')
+    total = 0.0
+    calls = 0
+    while total < minTime or calls < 3:
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        best = min(best, seconds)
+        total += seconds
+        calls += 1
+    return best
+
+
+@group
+def orbits(args):
+    m = loadExample('standard_map.json', args.cacheDir)
+    m.values['K'] = 0.97
+    seeds = 10 if args.quick else 100
+    steps = 1000
+    q0, p0 = m.seedGrid(int(np.sqrt(seeds)))
+    # The warm up run would fill the cache and every timed run would hit it
+    m.cache.resize(0)
+
+    m.values['q'], m.values['p'] = 1.0, 1.0
+    yield 'orbits/map', m.map, steps, 'points'
+
+    for backend in backends.BACKENDS:
+        if not backends.isAvailable(backend):
+            logging.warning('Skipping unavailable backend %s', backend)
+            continue
+        m.setBackend(backend)
+        for dtype in DTYPES:
+            m.setDtype(dtype)
+            name = 'orbits/mapBatch/%s' % backend
+            if dtype != 'float64':
+                name += '/' + dtype
+            yield (name, lambda: m.mapBatch(q0, p0, steps), q0.size * steps,
+                   'points')
+
+    m.setBackend('numpy')
+    m.setDtype('float64')
+    m.cache.resize(CACHE_BYTES)
+    yield ('orbits/cached', lambda: m.mapBatch(q0, p0, steps),
+           q0.size * steps, 'points')
+
+
+@group
+def gather(args):
+    m = loadExample('arnold_cat.json', args.cacheDir)
+    for size in QUICK_SIZES if args.quick else GATHER_SIZES:
+        m.setBaseImage(randomImage(size))
+        m.getPermutation()  # Calculated once per size, not per frame
+        yield 'gather/map/%d' % size, m.map, size * size, 'pixels'
+
+
+@group
+def resize(args):
+    m = loadExample('arnold_cat.json', args.cacheDir)
+    m.setBaseImage(randomImage(2048))
+
+    def run(size):
+        m.resized.clear()  # Measure the resampling, not the cache
+        m.resize(size)
+
+    for name in RESIZE_FILTERS:
+        m.setResizeFilter(name)
+        for size in (256, 1024):
+            yield ('resize/%s/%d' % (name, size),
+                   lambda size=size: run(size), size * size, 'pixels')
+
+
+@group
+def render(args):
+    try:
+        from PyQt5.QtWidgets import QApplication, QWidget
+    except ImportError:
+        logging.warning('Skipping render benchmarks, PyQt5 is not installed')
+        return
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    from src.tab_widget import ImageMapTab, StandardMapTab
+
+    m = loadExample('arnold_cat.json', args.cacheDir)
+    tab = ImageMapTab()
+    for size in (256,) if args.quick else (256, 1024):
+        m.setBaseImage(randomImage(size))
+        tab.setMap(m)
+        QWidget.resize(tab, 800, 800)
+        tab.show()
+        for direct in (False, True):
+            tab.direct.setChecked(direct)
+            app.processEvents()
+
+            def run():
+                tab.draw(m.image)
+                app.processEvents()
+
+            yield ('render/image/%s/%d' % ('direct' if direct else 'canvas',
+                                           size), run, size * size, 'pixels')
+    tab.close()
+
+    m = loadExample('standard_map.json', args.cacheDir)
+    m.values['K'] = 0.97
+    tab = StandardMapTab()
+    tab.setMap(m)
+    QWidget.resize(tab, 800, 800)
+    tab.show()
+    app.processEvents()
+    orbits = m.mapBatch(*m.seedGrid(10), 1000)
+    tab.plot(orbits)
+    app.processEvents()
+
+    def redraw():
+        tab.canvas.draw()
+        app.processEvents()
+
+    yield 'render/standard/redraw', redraw, orbits[0].size, 'points'
+
+    new = m.mapBatch(*m.seedGrid(3), 1000)
+
+    def blit():
+        tab.points.clear()  # Constant number of points on every run
+        tab.plot(new)
+        app.processEvents()
+
+    yield 'render/standard/blit', blit, new[0].size, 'points'
+    tab.close()
+
+
+def runBenchmarks(args):
+    results = OrderedDict()
+    for name in args.only or GROUPS:
+        for case, run, work, unit in GROUPS[name](args):
+            seconds = measure(run, args.min_time)
+            results[case] = {'seconds': seconds,
+                             'throughput': work / seconds,
+                             'unit': unit + '/s'}
+            print('%-32s %10.3f ms %14.4g %s/s'
+                  % (case, 1000 * seconds, work / seconds, unit))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compares the results against the baseline.
+
+    Returns:
+        list: Names of the cases that are slower than the baseline by more
+        than the threshold, i.e., 0.1 for 10 %.
+    """
+    regressions = []
+    print('\n%-32s %12s %12s %8s' % ('case', 'baseline', 'now', 'change'))
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        before = baseline[case]['seconds']
+        change = result['seconds'] / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(case)
+            flag = '  REGRESSION'
+        print('%-32s %9.3f ms %9.3f ms %+7.1f%%%s'
+              % (case, 1000 * before, 1000 * result['seconds'], 100 * change,
+                 flag))
+    return regressions
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark map calculations and drawing.')
+    parser.add_argument('--only', nargs='+', choices=list(GROUPS),
+                        help='run only these groups')
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller sizes, for a quick check')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='minimal total time per case in seconds')
+    parser.add_argument('--output', help='write the results to a json file')
+    parser.add_argument('--baseline',
+                        help='compare against the results in a json file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown that counts as regression')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArguments(sys.argv[1:] if argv is None else argv)
+    # The maps log every step, which would be measured too
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s: %(message)s')
+
+    # Sessions and decoded images of the benchmarks go into a temporary
+    # directory, so the caches of the user are neither used nor pruned
+    with tempfile.TemporaryDirectory(prefix='DS_benchmark-') as tmp:
+        store.SESSION_DIR = os.path.join(tmp, 'sessions')
+        args.cacheDir = os.path.join(tmp, 'images')
+        results = runBenchmarks(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'machine': platform.machine(),
+                       'processor': platform.processor(),
+                       'cpus': os.cpu_count(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'results': results}, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\n%d regressions over %.0f %%: %s'
+                  % (len(regressions), 100 * args.threshold,
+                     ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,70 +1,29 @@
 #!/usr/bin/env python3
 
 """This module visually represents maps.
+
+Heavy modules, i.e., PIL and numba, are only imported when they are
+needed and images are decoded in the background after the window is shown.
+The time of every startup phase is reported in the Log tab.
 """
+import time
+START = time.perf_counter()
+
 from PyQt5.QtWidgets import QTabWidget, QApplication, QMainWindow
 
-import glob
 import logging
-import os
-import json
 import sys
 
-import numpy as np
-from PIL import Image
-
-from src.maps import StandardMap, ImageMap
-from src.tab_widget import StandardMapTab, ImageMapTab
+from src.loader import loadMaps
+from src.tab_widget import StandardMapTab, ImageMapTab, MetricsTab
 from src.log import Log
 
-def loadMaps():
-    files = glob.glob('*.json')
-
-    maps = []
-    for f in files:
-        if not os.access(f, os.F_OK | os.R_OK):
-            logging.info('No reading access to %s', f)
-        logging.info('Reading %s', f)
-        with open(f, 'r') as f:
-            jsonString = f.read()
-
-        mapJson = json.loads(jsonString)
-        TYPE = mapJson['type']
-        logging.info('Creating map object of type %s', TYPE)
-
-        if TYPE == 'standard':
-            m = StandardMap()
-            m.setMod(mapJson['mod'])
-            m.setConstants(mapJson['constants'])
-            m.setVariables(mapJson['variables'])
-
-        elif TYPE == 'image':
-            m = ImageMap()
-            imageFile = mapJson['image']
-            logging.info('Reading image %s', imageFile)
-            img = Image.open(imageFile)
-            img.load()
-            imgArray = np.asarray(img, dtype=np.uint8)
-            img.close()
-            dim = imgArray.shape
-            if dim[0] != dim[1]:
-                logging.info('Picture is NOT square!')
-                continue
-            logging.info('Setting image.')
-            m.setBaseImage(imgArray)
+IMPORTED = time.perf_counter()
 
-        else:
-            logging.info('Unkown types: %s', TYPE)
-
-        m.setName(mapJson['name'])
-        m.setDescription(mapJson['description'])
 
-        m.processFunctions(mapJson['functions'])
+def elapsed(start, end):
+    return 1000 * (end - start)
 
-        logging.info('Loaded map of type %s and name %s', mapJson['type'],
-                     mapJson['name'])
-        maps.append(m)
-    return maps
 
 if __name__ == '__main__':
 
@@ -75,7 +34,9 @@ if __name__ == '__main__':
     main = QMainWindow()
     tabWidget = QTabWidget()
 
-    Maps = loadMaps()
+    created = time.perf_counter()
+    Maps = loadMaps(lazy=True)
+    loaded = time.perf_counter()
     for m in Maps:
         type = m.type
         if type == 'standard':
@@ -84,9 +45,19 @@ if __name__ == '__main__':
             tab = ImageMapTab()
         tab.setMap(m)
         tabWidget.addTab(tab, m.name)
+    tabWidget.addTab(MetricsTab(), 'Metrics')
     tabWidget.addTab(log, 'Log')
 
     main.setCentralWidget(tabWidget)
+    tabs = time.perf_counter()
     main.show()
+    shown = time.perf_counter()
+
+    logging.info('Startup: imports %.0f ms, application %.0f ms, maps %.0f '
+                 'ms, tabs %.0f ms, show %.0f ms, total %.0f ms',
+                 elapsed(START, IMPORTED), elapsed(IMPORTED, created),
+                 elapsed(created, loaded), elapsed(loaded, tabs),
+                 elapsed(tabs, shown), elapsed(START, shown))
 
+    app.aboutToQuit.connect(log.shutdown)
     sys.exit(app.exec_())
\ No newline at end of file
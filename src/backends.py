@@ -0,0 +1,93 @@
+"""Module with the calculation backends of maps.
+
+The default backend evaluates the compiled expressions with NumPy, one
+vectorized step at a time for all orbits. Long orbits are inherently
+sequential, so for them the optional ``numba`` backend turns the expressions
+into a single compiled kernel that runs the whole loop in machine code.
+Numba is an optional dependency and when it is not installed the NumPy
+backend is used instead.
+"""
+
+import ast
+import logging
+
+import numpy as np
+
+from src.expressions import FUNCTIONS, CONSTANTS
+
+BACKENDS = ('numpy', 'numba')
+
+KERNEL = '''
+def kernel(__q0, __p0, __constants, __mod, __outQ, __outP, __lastQ, __lastP):
+    __M, __steps = __outQ.shape
+{constants}
+    for __m in prange(__M):
+        q = __q0[__m]
+        p = __p0[__m]
+        __outQ[__m, 0] = q
+        __outP[__m, 0] = p
+        for __i in range(1, __steps):
+            q = ({q}) % __mod
+            p = ({p}) % __mod
+            __outQ[__m, __i] = q
+            __outP[__m, __i] = p
+        __lastQ[__m] = q
+        __lastP[__m] = p
+'''
+
+
+def isAvailable(backend):
+    """Checks if the backend can be used.
+    """
+    if backend == 'numpy':
+        return True
+    if backend == 'numba':
+        try:
+            import numba  # noqa: F401
+        except ImportError:
+            return False
+        return True
+    return False
+
+
+def standardKernel(functions, constants):
+    """Compiles the q and p expressions of a standard map into a numba
+    kernel.
+
+    The kernel is called as
+    ``kernel(q0, p0, constants, mod, q, p, lastQ, lastP)``, where constants
+    is an array with the values of the constants in the given order. It
+    writes the orbits into the arrays q and p of shape (M, steps), of any
+    float type, and the last points in float64 into lastQ and lastP. The
+    orbits are distributed over the CPU cores.
+
+    Arguments:
+        functions (dict): Compiled :class:`~expressions.Expression` for the
+            variables q and p
+        constants (list): Names of the constants
+
+    Returns:
+        function: Compiled kernel
+    """
+    import numba
+
+    if numba.config.THREADING_LAYER == 'default':
+        # With TBB the interpreter does not exit anymore once a kernel ran on
+        # a worker thread of Qt, so prefer OpenMP. The workqueue layer does
+        # not allow kernels of two maps to run at the same time.
+        numba.config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+
+    unpack = ''.join('    %s = __constants[%d]\n' % (name, i)
+                     for i, name in enumerate(constants))
+    source = KERNEL.format(constants=unpack,
+                           q=ast.unparse(functions['q'].tree),
+                           p=ast.unparse(functions['p'].tree))
+
+    namespace = {'np': np, 'prange': numba.prange}
+    namespace.update(FUNCTIONS)
+    namespace.update(CONSTANTS)
+    exec(compile(source, '<kernel>', 'exec'), namespace)
+
+    logging.info('Compiling numba kernel for q: %s, p: %s',
+                 functions['q'].source, functions['p'].source)
+    return numba.njit(parallel=True)(namespace['kernel'])
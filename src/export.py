@@ -0,0 +1,220 @@
+"""Module for exporting iterations of image maps as animations.
+
+Frames are streamed: every frame is encoded on a pool of threads while the
+next iterations are calculated, and written in order as soon as it is
+encoded. At most a fixed number of frames is in flight at any time, so the
+memory does not grow with the length of the sequence. Pillow releases the
+GIL while quantizing and compressing, so the threads encode in parallel.
+
+Supported formats are animated GIF, animated PNG (APNG) and a directory of
+PNG frames. Pillow can write the animations itself, but only by collecting
+all frames first, so the containers are written here chunk by chunk.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import io
+import logging
+import os
+import struct
+import zlib
+
+import numpy as np
+
+FORMATS = ('gif', 'apng', 'png')
+
+
+class GifWriter(object):
+    """Writes frames into an endlessly looping animated GIF. Every frame is
+    quantized on its own and gets a local colour table.
+    """
+
+    def __init__(self, output, fps, count=None):
+        self.file = open(output, 'wb')
+        self.duration = 1000.0 / fps
+        self.header = False
+
+    def encode(self, img):
+        from PIL import Image, GifImagePlugin
+
+        frame = Image.fromarray(img)
+        if frame.mode not in ('L', 'P'):
+            frame = frame.quantize(method=Image.Quantize.FASTOCTREE)
+        chunks = GifImagePlugin.getdata(frame, include_color_table=True,
+                                        duration=self.duration)
+        return frame.size, b''.join(chunks)
+
+    def write(self, iteration, data):
+        size, frame = data
+        if not self.header:
+            # Logical screen without global colour table and a loop forever
+            # application extension
+            self.file.write(b'GIF89a' + struct.pack('<HHBBB', *size, 0, 0, 0))
+            self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+            self.header = True
+        self.file.write(frame)
+
+    def close(self):
+        if self.header:
+            self.file.write(b';')
+        self.file.close()
+
+
+class ApngWriter(object):
+    """Writes frames into an endlessly looping animated PNG.
+
+    Each frame is compressed as a regular PNG and its image data is moved
+    into the frame chunks of the animation. The number of frames is written
+    before the first frame, so it is corrected on :meth:`close` if the
+    export stopped early.
+    """
+
+    def __init__(self, output, fps, count=None):
+        self.file = open(output, 'wb')
+        self.count = count or 0
+        self.delay = int(round(1000.0 / fps))
+        self.sequence = 0
+        self.frames = 0
+        self.acTL = None
+
+    def encode(self, img):
+        from PIL import Image
+
+        buf = io.BytesIO()
+        Image.fromarray(img).save(buf, 'PNG')
+        png = buf.getvalue()
+
+        header = None
+        data = []
+        position = 8  # After the signature
+        while position < len(png):
+            length, kind = struct.unpack('>I4s', png[position:position + 8])
+            chunk = png[position + 8:position + 8 + length]
+            if kind == b'IHDR':
+                header = chunk
+            elif kind == b'IDAT':
+                data.append(chunk)
+            position += length + 12
+        return header, b''.join(data)
+
+    def chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data +
+                        struct.pack('>I', zlib.crc32(kind + data)))
+
+    def write(self, iteration, data):
+        header, frame = data
+        if self.acTL is None:
+            self.file.write(b'\x89PNG\r\n\x1a\n')
+            self.chunk(b'IHDR', header)
+            self.acTL = self.file.tell()
+            self.chunk(b'acTL', struct.pack('>II', self.count, 0))
+
+        width, height = struct.unpack('>II', header[:8])
+        self.chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence, width,
+                                        height, 0, 0, self.delay, 1000, 0, 0))
+        self.sequence += 1
+        if self.frames == 0:
+            self.chunk(b'IDAT', frame)
+        else:
+            self.chunk(b'fdAT', struct.pack('>I', self.sequence) + frame)
+            self.sequence += 1
+        self.frames += 1
+
+    def close(self):
+        if self.acTL is not None:
+            self.chunk(b'IEND', b'')
+            if self.frames != self.count:
+                self.file.seek(self.acTL)
+                self.chunk(b'acTL', struct.pack('>II', self.frames, 0))
+        self.file.close()
+
+
+class FrameWriter(object):
+    """Writes every frame into its own PNG file, named after its iteration.
+    """
+
+    def __init__(self, output, fps=None, count=None):
+        os.makedirs(output, exist_ok=True)
+        self.output = output
+
+    def encode(self, img):
+        from PIL import Image
+
+        buf = io.BytesIO()
+        Image.fromarray(img).save(buf, 'PNG')
+        return buf.getvalue()
+
+    def write(self, iteration, data):
+        name = os.path.join(self.output, 'frame_%06d.png' % iteration)
+        with open(name, 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+WRITERS = {'gif': GifWriter, 'apng': ApngWriter, 'png': FrameWriter}
+
+
+def exportFrames(frames, output, format='gif', fps=10, count=None,
+                 workers=None, queueSize=None, progress=None, cancel=None):
+    """Encodes and writes frames, e.g., from :meth:`~maps.ImageMap.frames`.
+
+    Arguments:
+        frames (iterable): Pairs of iteration and image (uint8 array of
+            shape (N, M) or (N, M, 3)). The next frame is only taken when
+            there is room in the queue.
+        output (str): File of the animation, or directory for png frames
+        format (str): One of :data:`FORMATS`
+        fps (float): Frames per second of the animation
+        count (int): Number of frames, if known in advance
+        workers (int): Number of encoding threads. Default is the number of
+            CPUs
+        queueSize (int): Maximum number of frames in flight. Default is two
+            per thread
+        progress (function): Called as progress(done, count) after every
+            written frame
+        cancel (threading.Event): Stops the export when set. The frames
+            written so far form a valid animation.
+
+    Returns:
+        int: Number of written frames
+    """
+    if format not in WRITERS:
+        raise ValueError('Unknown export format %s, use one of %s'
+                         % (format, ', '.join(FORMATS)))
+    workers = workers or os.cpu_count()
+    queueSize = queueSize or 2 * workers
+    writer = WRITERS[format](output, fps, count)
+    logging.info('Exporting frames to %s on %d threads', output, workers)
+
+    done = 0
+    pending = deque()
+
+    def writeNext():
+        nonlocal done
+        iteration, future = pending.popleft()
+        writer.write(iteration, future.result())
+        done += 1
+        if progress is not None:
+            progress(done, count)
+
+    with ThreadPoolExecutor(workers) as executor:
+        try:
+            for iteration, img in frames:
+                if cancel is not None and cancel.is_set():
+                    break
+                if len(pending) >= queueSize:
+                    writeNext()
+                pending.append((iteration, executor.submit(
+                    writer.encode, np.ascontiguousarray(img))))
+            while pending:
+                writeNext()
+        finally:
+            for _, future in pending:
+                future.cancel()
+            writer.close()
+
+    logging.info('Exported %d frames to %s', done, output)
+    return done
@@ -0,0 +1,288 @@
+"""Module that compiles the function expressions of maps.
+
+The expressions from the json files are parsed with :mod:`ast` and every node
+of the syntax tree is checked against a whitelist. Only arithmetic, numbers,
+the variables and constants of the map and a few mathematical functions are
+allowed. The checked tree is then compiled into a plain python function, whose
+arguments are the variables and constants, so evaluating it requires neither
+``eval`` nor dictionary lookups and works on scalars and NumPy arrays alike.
+"""
+
+import ast
+
+import numpy as np
+
+FUNCTIONS = {
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'arcsin': np.arcsin,
+    'arccos': np.arccos,
+    'arctan': np.arctan,
+    'sinh': np.sinh,
+    'cosh': np.cosh,
+    'tanh': np.tanh,
+    'exp': np.exp,
+    'log': np.log,
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+    'floor': np.floor,
+}
+
+CONSTANTS = {
+    'pi': np.pi,
+}
+
+NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load,
+    ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+)
+
+
+class ExpressionError(ValueError):
+    """Raised when a string is not an allowed map expression.
+    """
+
+
+class Expression(object):
+    """Compiled map expression.
+
+    Calling the object evaluates the expression. The arguments are the values
+    of :attr:`arguments` in the same order.
+
+    Attributes:
+        source (str): Expression as written in the json file
+        arguments (list): Names of the variables and constants, in the order
+            they are passed to the function
+        tree (ast.Expression): Checked syntax tree of the expression
+        function (function): Compiled python function
+    """
+
+    def __init__(self, source, arguments):
+        self.source = source
+        self.arguments = list(arguments)
+        self.tree = parse(source, self.arguments)
+        self.function = build(self.tree, self.arguments)
+
+    def __call__(self, *args):
+        return self.function(*args)
+
+    def __repr__(self):
+        return 'Expression(%r, %r)' % (self.source, self.arguments)
+
+    def derivative(self, name):
+        """Returns the partial derivative with respect to one of the
+        arguments as a new compiled expression.
+        """
+        tree = ast.Expression(body=differentiate(self.tree.body, name))
+        return Expression(ast.unparse(tree), self.arguments)
+
+
+def parse(source, arguments):
+    """Parses the source into a syntax tree and checks that it only contains
+    allowed nodes and names.
+
+    Arguments:
+        source (str): Expression string
+        arguments (list): Names of the variables and constants
+
+    Returns:
+        ast.Expression: Checked syntax tree
+    """
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ExpressionError('String %s is not an expression: %s'
+                              % (source, e.msg))
+
+    # Names of functions may only appear as the called function
+    called = set(id(node.func) for node in ast.walk(tree)
+                 if isinstance(node, ast.Call))
+
+    for node in ast.walk(tree):
+        if not isinstance(node, NODES):
+            raise ExpressionError('%s is not allowed in expression %s'
+                                  % (type(node).__name__, source))
+
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or \
+                    not isinstance(node.value, (int, float)):
+                raise ExpressionError('Constant %r is not allowed in '
+                                      'expression %s' % (node.value, source))
+
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or \
+                    node.func.id not in FUNCTIONS or \
+                    node.func.id in arguments:
+                raise ExpressionError('Only the functions %s can be called '
+                                      'in expression %s'
+                                      % (', '.join(FUNCTIONS), source))
+            if len(node.args) != 1 or node.keywords:
+                raise ExpressionError('Function %s takes exactly one '
+                                      'argument in expression %s'
+                                      % (node.func.id, source))
+
+        elif isinstance(node, ast.Name):
+            if id(node) in called or node.id in arguments or \
+                    node.id in CONSTANTS:
+                continue
+            raise ExpressionError('Unknown name %s in expression %s'
+                                  % (node.id, source))
+
+    return tree
+
+
+def build(tree, arguments):
+    """Compiles a checked syntax tree into a python function, taking the
+    arguments in the given order.
+    """
+    args = ast.arguments(posonlyargs=[],
+                         args=[ast.arg(arg=name) for name in arguments],
+                         vararg=None, kwonlyargs=[], kw_defaults=[],
+                         kwarg=None, defaults=[])
+    lambdaTree = ast.Expression(body=ast.Lambda(args=args, body=tree.body))
+    ast.fix_missing_locations(lambdaTree)
+
+    namespace = {'__builtins__': {}}
+    namespace.update(FUNCTIONS)
+    namespace.update(CONSTANTS)
+    return eval(compile(lambdaTree, '<expression>', 'eval'), namespace)
+
+
+# Derivatives of the functions, as expression templates of the argument u
+DERIVATIVES = {
+    'sin': 'cos(u)',
+    'cos': '-sin(u)',
+    'tan': '1 / cos(u) ** 2',
+    'arcsin': '1 / sqrt(1 - u ** 2)',
+    'arccos': '-1 / sqrt(1 - u ** 2)',
+    'arctan': '1 / (1 + u ** 2)',
+    'sinh': 'cosh(u)',
+    'cosh': 'sinh(u)',
+    'tanh': '1 - tanh(u) ** 2',
+    'exp': 'exp(u)',
+    'log': '1 / u',
+    'sqrt': '1 / (2 * sqrt(u))',
+    'abs': 'u / abs(u)',
+    'floor': '0',
+}
+
+
+def _isConstant(node, value):
+    return isinstance(node, ast.Constant) and node.value == value
+
+
+def _binOp(left, op, right):
+    """Creates a binary operation and removes the trivial zeros and ones,
+    so the derivatives stay cheap to evaluate.
+    """
+    if isinstance(op, ast.Add):
+        if _isConstant(left, 0):
+            return right
+        if _isConstant(right, 0):
+            return left
+    elif isinstance(op, ast.Sub):
+        if _isConstant(right, 0):
+            return left
+        if _isConstant(left, 0):
+            return ast.UnaryOp(op=ast.USub(), operand=right)
+    elif isinstance(op, ast.Mult):
+        if _isConstant(left, 0) or _isConstant(right, 0):
+            return ast.Constant(value=0)
+        if _isConstant(left, 1):
+            return right
+        if _isConstant(right, 1):
+            return left
+    elif isinstance(op, ast.Div):
+        if _isConstant(left, 0):
+            return ast.Constant(value=0)
+        if _isConstant(right, 1):
+            return left
+    return ast.BinOp(left=left, op=op, right=right)
+
+
+def _substitute(template, u):
+    """Parses a template of DERIVATIVES and replaces u with the node.
+    """
+    tree = ast.parse(template, mode='eval').body
+    for node in ast.walk(tree):
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.Name) and value.id == 'u':
+                setattr(node, field, u)
+            elif isinstance(value, list):
+                value[:] = [u if isinstance(v, ast.Name) and v.id == 'u'
+                            else v for v in value]
+    if isinstance(tree, ast.Name) and tree.id == 'u':
+        return u
+    return tree
+
+
+def differentiate(node, name):
+    """Symbolically differentiates a checked expression node with respect to
+    the name.
+
+    The modulus is treated as the identity, since it does not change the
+    derivative except on the measure zero set where it jumps.
+
+    Returns:
+        ast.AST: Node of the derivative
+    """
+    if isinstance(node, ast.Constant):
+        return ast.Constant(value=0)
+
+    if isinstance(node, ast.Name):
+        return ast.Constant(value=1 if node.id == name else 0)
+
+    if isinstance(node, ast.UnaryOp):
+        d = differentiate(node.operand, name)
+        if isinstance(node.op, ast.USub) and not _isConstant(d, 0):
+            return ast.UnaryOp(op=ast.USub(), operand=d)
+        return d
+
+    if isinstance(node, ast.Call):
+        du = differentiate(node.args[0], name)
+        if _isConstant(du, 0):
+            return du
+        outer = _substitute(DERIVATIVES[node.func.id], node.args[0])
+        return _binOp(outer, ast.Mult(), du)
+
+    a, b, op = node.left, node.right, node.op
+    da = differentiate(a, name)
+    db = differentiate(b, name)
+
+    if isinstance(op, (ast.Add, ast.Sub)):
+        return _binOp(da, op, db)
+
+    if isinstance(op, ast.Mult):
+        return _binOp(_binOp(da, ast.Mult(), b), ast.Add(),
+                      _binOp(a, ast.Mult(), db))
+
+    if isinstance(op, ast.Div):
+        numerator = _binOp(_binOp(da, ast.Mult(), b), ast.Sub(),
+                           _binOp(a, ast.Mult(), db))
+        return _binOp(numerator, ast.Div(),
+                      _binOp(b, ast.Pow(), ast.Constant(value=2)))
+
+    if isinstance(op, ast.Pow):
+        if _isConstant(db, 0):
+            # n * a ** (n - 1) * da
+            power = _binOp(b, ast.Sub(), ast.Constant(value=1))
+            return _binOp(_binOp(b, ast.Mult(), _binOp(a, ast.Pow(), power)),
+                          ast.Mult(), da)
+        # a ** b * (db * log(a) + b * da / a)
+        log = ast.Call(func=ast.Name(id='log', ctx=ast.Load()), args=[a],
+                       keywords=[])
+        inner = _binOp(_binOp(db, ast.Mult(), log), ast.Add(),
+                       _binOp(_binOp(b, ast.Mult(), da), ast.Div(), a))
+        return _binOp(node, ast.Mult(), inner)
+
+    if isinstance(op, ast.Mod):
+        if not _isConstant(db, 0):
+            raise ExpressionError('Can not differentiate a modulus that '
+                                  'depends on %s' % name)
+        return da
+
+    # Floor division is piecewise constant
+    return ast.Constant(value=0)
@@ -0,0 +1,82 @@
+"""Module that caches decoded images on disk.
+
+Decoding large images takes time on every launch, so the decoded arrays are
+stored as .npy files named after the hash of the image file. Cached arrays
+are loaded memory-mapped and read-only, so the original image is shared with
+the page cache instead of being a private copy in every process.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join('~', '.cache')),
+    'MofDS-GUI')
+
+
+def fileHash(fileName):
+    """Returns the SHA-1 hex digest of the file content.
+    """
+    digest = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def decodeImage(fileName):
+    """Decodes an image file into an uint8 array.
+    """
+    from PIL import Image
+
+    img = Image.open(fileName)
+    img.load()
+    imgArray = np.asarray(img, dtype=np.uint8)
+    img.close()
+    return imgArray
+
+
+def loadImageArray(fileName, cacheDir=CACHE_DIR):
+    """Returns the decoded image, from the cache if possible.
+
+    Arguments:
+        fileName (str): Image file
+        cacheDir (str): Directory of the cache. None disables the cache.
+
+    Returns:
+        ndarray: Read-only array, memory-mapped if it comes from the cache
+    """
+    if cacheDir is None:
+        imgArray = decodeImage(fileName)
+        imgArray.flags.writeable = False
+        return imgArray
+
+    cacheDir = os.path.expanduser(cacheDir)
+    path = os.path.join(cacheDir, fileHash(fileName) + '.npy')
+    if os.path.exists(path):
+        try:
+            logging.info('Loading cached image %s', path)
+            return np.load(path, mmap_mode='r')
+        except (ValueError, OSError) as e:
+            logging.warning('Corrupt image cache %s: %s', path, e)
+
+    imgArray = decodeImage(fileName)
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        # Written to a temporary file first, so other processes never see a
+        # partially written cache
+        fd, tmpPath = tempfile.mkstemp(suffix='.npy', dir=cacheDir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, imgArray)
+        os.replace(tmpPath, path)
+    except OSError as e:
+        logging.warning('Could not cache image %s: %s', fileName, e)
+        imgArray.flags.writeable = False
+        return imgArray
+
+    logging.info('Cached image %s as %s', fileName, path)
+    return np.load(path, mmap_mode='r')
@@ -0,0 +1,83 @@
+"""Module that loads maps from json files.
+
+It does not depend on Qt, so maps can also be loaded in batch jobs without a
+display.
+"""
+
+import glob
+import logging
+import os
+import json
+
+from src.maps import StandardMap, ImageMap
+
+
+def loadMap(fileName, lazy=False):
+    """Creates a map from a json file.
+
+    Arguments:
+        fileName (str): Path to the json file
+        lazy (bool): If True, images of image maps are not decoded yet, see
+            :meth:`maps.ImageMap.loadImage`
+
+    Returns:
+        Map: The map or None if the file does not describe a usable map
+    """
+    logging.info('Reading %s', fileName)
+    with open(fileName, 'r') as f:
+        jsonString = f.read()
+
+    mapJson = json.loads(jsonString)
+    TYPE = mapJson['type']
+    logging.info('Creating map object of type %s', TYPE)
+
+    if TYPE == 'standard':
+        m = StandardMap()
+        m.setMod(mapJson['mod'])
+        m.setConstants(mapJson['constants'])
+        m.setVariables(mapJson['variables'])
+        m.setSteps(mapJson.get('steps', m.steps))
+        m.setDtype(mapJson.get('dtype', 'float64'))
+
+    elif TYPE == 'image':
+        m = ImageMap()
+        m.setImageFile(mapJson['image'])
+        m.setFit(mapJson.get('fit', 'none'))
+        if not lazy:
+            try:
+                m.loadImage()
+            except ValueError as e:
+                logging.info('%s', e)
+                return None
+        m.setVariables(mapJson['variables'])
+        m.setConstants(mapJson.get('constants', []))
+
+    else:
+        logging.info('Unkown types: %s', TYPE)
+        return None
+
+    m.setName(mapJson['name'])
+    m.setDescription(mapJson['description'])
+
+    m.processFunctions(mapJson['functions'])
+    m.setBackend(mapJson.get('backend', 'numpy'))
+
+    logging.info('Loaded map of type %s and name %s', mapJson['type'],
+                 mapJson['name'])
+    return m
+
+
+def loadMaps(pattern='*.json', lazy=False):
+    """Loads all maps from the json files matching the pattern.
+    """
+    files = glob.glob(pattern)
+
+    maps = []
+    for f in files:
+        if not os.access(f, os.F_OK | os.R_OK):
+            logging.info('No reading access to %s', f)
+            continue
+        m = loadMap(f, lazy)
+        if m is not None:
+            maps.append(m)
+    return maps
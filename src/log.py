@@ -4,28 +4,38 @@
 """
 
 from PyQt5.QtWidgets import QPlainTextEdit
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject
+from PyQt5.QtCore import (QThread, QTimer, pyqtSignal, pyqtSlot, QObject,
+                          QMetaObject, Qt)
+import copy
+import html
 import queue
 import logging
 
+COLOURS = {logging.DEBUG: 'blue',
+           logging.INFO: 'orange',
+           logging.WARNING: 'blue',
+           logging.ERROR: 'red',
+           logging.CRITICAL: 'magenta'}
+
 
 class LoggingHandler(logging.Handler):
-    def __init__(self, stream):
-        super(LoggingHandler, self).__init__()
+    """Puts the records into the stream. Only the message is merged with its
+    arguments here, while they still have the values of the logging call,
+    the rest of the formatting is left to the :class:`LogReceiver`. Records
+    below the level of the handler are dropped by
+    :meth:`logging.Handler.handle` before they reach :meth:`emit`.
+    """
+
+    def __init__(self, stream, level=logging.NOTSET):
+        super(LoggingHandler, self).__init__(level)
         self.stream = stream
 
     def emit(self, record):
-        msg = self.format(record)
-        if record.levelno == logging.DEBUG:
-            self.stream.write('<font color="blue">' + msg + '</font>')
-        elif record.levelno == logging.INFO:
-            self.stream.write('<font color="orange">' + msg + '</font>')
-        elif record.levelno == logging.WARNING:
-            self.stream.write('<font color="blue">' + msg + '</font>')
-        elif record.levelno == logging.ERROR:
-            self.stream.write('<font color="red">' + msg + '</font>')
-        else:  # logging.CRITICAL
-            self.stream.write('<font color="magenta">' + msg + '</font>')
+        # Other handlers get the same record, so it is not changed
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        self.stream.write(record)
 
 
 class WriteStream(object):
@@ -52,41 +62,100 @@ class WriteStream(object):
 class LogReceiver(QObject):
     """ Receives log messages from Logging and sys.stdout.
 
-    A QObject (to be run in a QThread) which sits waiting for data to come
-    through a queue.Queue(). It blocks until data is available, and once it
-    has got something from the queue, it sends it to the "MainThread"
-    by emitting a Qt Signal.
+    A QObject (to be run in a QThread) which drains the queue.Queue() on a
+    short timer. All messages that arrived since the last drain are
+    formatted as HTML and sent to the "MainThread" by emitting a single Qt
+    Signal, so the text edit is updated once per batch instead of once per
+    message.
+
+    Arguments:
+        queue (queue.Queue): Queue with log records and text
+        formatter (logging.Formatter): Formatter of the log records
     """
     logSignal = pyqtSignal(str)
 
-    def __init__(self, queue, *args, **kwargs):
+    INTERVAL = 100  # Drain interval in milliseconds
+    BATCH = 1000  # Maximum number of messages per signal
+
+    def __init__(self, queue, formatter, *args, **kwargs):
         QObject.__init__(self, *args, **kwargs)
         self.queue = queue
+        self.formatter = formatter
+        self.timer = None
 
     @pyqtSlot()
     def run(self):
+        """Starts draining, runs in the thread of the receiver.
+        """
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.drain)
+        self.timer.start(self.INTERVAL)
+
+    @pyqtSlot()
+    def stop(self):
+        """Stops draining, has to run in the thread of the receiver.
+        """
+        if self.timer is not None:
+            self.timer.stop()
+
+    def format(self, item):
+        if not isinstance(item, logging.LogRecord):
+            return html.escape(item)
+        colour = COLOURS.get(item.levelno, 'magenta')
+        return '<font color="%s">%s</font>' % (
+            colour, html.escape(self.formatter.format(item)))
+
+    @pyqtSlot()
+    def drain(self):
+        """Emits everything that is in the queue, in batches of at most
+        :attr:`BATCH` messages. Every message becomes its own block of the
+        document.
+        """
         while True:
-            text = self.queue.get()
-            self.logSignal.emit(text)
+            lines = []
+            try:
+                while len(lines) < self.BATCH:
+                    lines.append(self.format(self.queue.get_nowait()))
+            except queue.Empty:
+                pass
+            if lines:
+                self.logSignal.emit(''.join('<div>%s</div>' % line
+                                            for line in lines))
+            if len(lines) < self.BATCH:
+                return
 
 
 class Log(QPlainTextEdit):
+    """Read-only text edit that shows the log.
+
+    Only the last :attr:`MAX_BLOCKS` messages are kept, older ones are
+    removed from the document. Call :meth:`shutdown` before the application
+    quits, which stops the receiver thread after showing the remaining
+    messages.
+    """
+
+    MAX_BLOCKS = 5000
 
     def __init__(self, parent=None, initiate=True):
         super(Log, self).__init__(parent)
 
         self.setReadOnly(True)
         self.setLineWrapMode(QPlainTextEdit.WidgetWidth)
+        self.setMaximumBlockCount(self.MAX_BLOCKS)
+        self.logThread = None
+        self.logHandler = None
 
         if initiate:
             self.initiate()
 
-    def initiate(self):
+    def initiate(self, logLevel=logging.INFO):
         self.logThread = QThread()
         logQueue = queue.Queue()
         logStream = WriteStream(logQueue)
 
-        self.logReceiver = LogReceiver(logQueue)
+        logFormat = "%(asctime)s - %(levelname)s: %(message)s"
+        self.logReceiver = LogReceiver(logQueue,
+                                       logging.Formatter(logFormat))
 
         self.logReceiver.logSignal.connect(self.appendHtml)
         self.logReceiver.moveToThread(self.logThread)
@@ -94,15 +163,25 @@ class Log(QPlainTextEdit):
 
         self.logThread.start()
 
-        logHandler = LoggingHandler(logStream)
-        logFormat = "%(asctime)s - %(levelname)s: %(message)s"
-        logHandler.setFormatter(logging.Formatter(logFormat))
-
-        logging.getLogger().addHandler(logHandler)
-
-        logLevel = logging.INFO
+        self.logHandler = LoggingHandler(logStream, logLevel)
+        logging.getLogger().addHandler(self.logHandler)
         logging.getLogger().setLevel(logLevel)
 
+    @pyqtSlot()
+    def shutdown(self):
+        """Detaches from logging, stops the receiver thread and shows the
+        messages that were still queued.
+        """
+        if self.logThread is None:
+            return
+        logging.getLogger().removeHandler(self.logHandler)
+        QMetaObject.invokeMethod(self.logReceiver, 'stop',
+                                 Qt.BlockingQueuedConnection)
+        self.logThread.quit()
+        self.logThread.wait()
+        self.logThread = None
+        self.logReceiver.drain()
+
 
 if __name__ == "__main__":
     from PyQt5.QtWidgets import QApplication, QMainWindow
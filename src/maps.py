@@ -1,11 +1,72 @@
-from PyQt5.QtCore import QObject, pyqtProperty, pyqtSlot
+try:
+    from PyQt5.QtCore import QObject, pyqtProperty, pyqtSlot
+except ImportError:
+    # Headless use without Qt, i.e., DS_batch.py. The maps only use Qt for
+    # slots and properties, so plain python equivalents are enough.
+    class QObject(object):
+        def __init__(self, parent=None):
+            pass
+
+    def pyqtSlot(*types):
+        return lambda function: function
+
+    def pyqtProperty(type, fget, fset):
+        return property(fget, fset)
+
+from collections import OrderedDict
 
 import logging
-import parser
+import math
+import time
 import numpy as np
-from scipy.misc import imresize
 
-TRIFUNC = ['sin', 'cos']
+from src import backends
+from src.expressions import Expression, ExpressionError
+from src.image_cache import CACHE_DIR, loadImageArray
+from src.metrics import span
+from src.orbit_cache import CACHE_DIGITS, OrbitCache
+
+# Resize filters and the names of the corresponding Pillow constants
+RESIZE_FILTERS = OrderedDict([
+    ('nearest', 'NEAREST'),
+    ('bilinear', 'BILINEAR'),
+    ('lanczos', 'LANCZOS'),
+])
+RESIZE_CACHE = 8  # Number of resized images to keep
+STREAM_CHUNK = 1000000  # Points of all orbits per chunk of mapStream
+
+FITS = ('none', 'crop', 'pad')
+DTYPES = ('float64', 'float32')  # Storage types of orbits
+INDEX_BLOCK = 2**20  # Pixels per block of ImageMap.mapIndexes
+
+
+def fitImage(img, fit):
+    """Makes a rectangular image square if requested.
+
+    Arguments:
+        img (ndarray): Image with shape (N, M) or (N, M, channels)
+        fit (str): none returns the image as it is, crop returns a view of
+            the centred square and pad centres the image on a black square
+
+    Returns:
+        ndarray: The fitted image
+    """
+    rows, columns = img.shape[:2]
+    if fit == 'none' or rows == columns:
+        return img
+
+    if fit == 'crop':
+        size = min(rows, columns)
+        top = (rows - size) // 2
+        left = (columns - size) // 2
+        return img[top:top + size, left:left + size]
+
+    size = max(rows, columns)
+    top = (size - rows) // 2
+    left = (size - columns) // 2
+    padded = np.zeros((size, size) + img.shape[2:], dtype=img.dtype)
+    padded[top:top + rows, left:left + columns] = img
+    return padded
 
 
 class Map(QObject):
@@ -15,13 +76,16 @@ class Map(QObject):
         name (str): Name of map for representation or short description
         description (str): Longer description about the map
         mod (float): Modulus number
-        steps (int): Number of iterations to perform. Default 1000
+        steps (int): Number of iterations to perform, i.e., points per
+            orbit. Set with "steps" in the json file. Default 1000
         variables (list): A list of variables to calculate
         constants (list): A list of constants the user can change
         values (dict): A dictionary of values corresponding to the variables
             and constants
-        functions (dict): A dictionary of compiled functions that calculate the
-            next values
+        functions (dict): A dictionary of compiled
+            :class:`~expressions.Expression` that calculate the next values
+        backend (str): Active calculation backend, one of
+            :data:`backends.BACKENDS`. Default numpy
     """
 
     def __init__(self, parent=None):
@@ -34,6 +98,7 @@ class Map(QObject):
         self.constants = []
         self.values = {}
         self.functions = {}
+        self.backend = 'numpy'
 
     @pyqtSlot(str)
     def setName(self, name):
@@ -62,44 +127,84 @@ class Map(QObject):
 
     MOD = pyqtProperty(float, getMod, setMod)
 
+    @pyqtSlot(int)
+    def setSteps(self, steps):
+        if steps < 1:
+            logging.error('Number of steps for map "%s" must be positive, '
+                          'got %d', self.name, steps)
+            return
+        self.steps = steps
+
+    def getSteps(self):
+        return self.steps
+
+    STEPS = pyqtProperty(int, getSteps, setSteps)
+
+    @pyqtSlot(str)
+    def setBackend(self, backend):
+        """Selects the calculation backend. If the backend is not available,
+        i.e., numba is not installed, the numpy backend is used instead.
+        """
+        if backend not in backends.BACKENDS:
+            logging.error('Unknown backend %s for map "%s"', backend,
+                          self.name)
+            return
+        if not backends.isAvailable(backend):
+            logging.warning('Backend %s is not available for map "%s". Using '
+                            'numpy.', backend, self.name)
+            backend = 'numpy'
+        logging.info('Using backend %s for map "%s"', backend, self.name)
+        self.backend = backend
+
+    def getBackend(self):
+        return self.backend
+
+    BACKEND = pyqtProperty(str, getBackend, setBackend)
+
+    def setVariables(self, list):
+        self.variables = list
+        for var in self.variables:
+            self.values[var] = 0.0
+
+    def setConstants(self, list):
+        self.constants = list
+        for var in self.constants:
+            self.values[var] = 0.0
+
     def processFunctions(self, funcs):
-        """Process the functions string in order that the variables are
-        first replaced with self.variables['name_of_variable']. The name
-        for variables should be unique, i.e., avoid using c,o,s,i,n, as these
-        are used in other mathematical functions.
+        """Compiles the function strings. The strings are parsed with
+        :mod:`ast` and may only contain arithmetic, numbers, the names from
+        :attr:`variables` and :attr:`constants` and the mathematical functions
+        from :data:`expressions.FUNCTIONS`. Names are resolved as a whole, so
+        variables like s or n do not interfere with sin.
         """
         logging.info('Parsing functions.')
+        arguments = self.variables + self.constants
         for function in funcs:
             funcStr = funcs[function]
             logging.info('Function for variable %s: %s', function, funcStr)
 
-            # Replacing variables, i.e, q -> self.values['q']
-            # Also replacing sin as np.sin, and other trigonometry functions
-
-            for V in self.variables:
-                funcStr = funcStr.replace(V, 'self.values["' + V + '"]')
-            for V in self.constants:
-                funcStr = funcStr.replace(V, 'self.values["' + V + '"]')
-
-            # Basic trigonometry functions
-            for F in TRIFUNC:
-                funcStr = funcStr.replace(F, 'np.' + F)
-
-            # Parsing the function string as an expression
-            eq = parser.expr(funcStr)
-
-            # Check if the function string is REALLY an expression and not
-            # some strange import os; os.system("rm -rf /home")
-            # ... hopefully
-            if not eq.isexpr():
-                logging.error('String %s is not an expression!', funcStr)
+            try:
+                obj = Expression(funcStr, arguments)
+            except ExpressionError as e:
+                logging.error('%s', e)
                 return
 
-            # Compile into python object
-            obj = eq.compile()
             logging.info('Successfully compiled %s for %s', funcStr, function)
             self.functions[function] = obj
 
+    def evaluate(self, function, values):
+        """Evaluates a compiled function.
+
+        Arguments:
+            function (str): Name of the variable the function calculates
+            values (dict): Values of the variables and constants. These can
+                be scalars or NumPy arrays, in which case the function is
+                evaluated element-wise.
+        """
+        func = self.functions[function]
+        return func(*[values[name] for name in func.arguments])
+
     def map(self):
         """Virtual function to calculate the next frame of the map. Hardcoded
         to return two arrays, i.e., X and Y.
@@ -109,114 +214,774 @@ class Map(QObject):
 
 class StandardMap(Map):
     """Standard map as in the usual maps in q, p.
+
+    Attributes:
+        kernel (function): Compiled kernel of the numba backend. None until
+            it is first needed.
+        jacobian (dict): Compiled partial derivatives of the functions,
+            i.e., jacobian['p', 'q'] is dp'/dq. None until it is first needed.
+        cache (OrbitCache): Calculated orbits, see :meth:`mapCached`
+        dtype (numpy.dtype): Type in which the points of orbits are stored,
+            one of :data:`DTYPES`. Set with "dtype" in the json file. The
+            orbits are always calculated in float64, float32 only rounds
+            the stored points and halves their memory. Default float64
+        buffers (tuple): q and p arrays reused by :meth:`map`
+        lastPoints (tuple): float64 q and p values of the last points of
+            the latest :meth:`calculate`
     """
 
     def __init__(self, parent=None):
         super(StandardMap, self).__init__(parent)
         self.type = 'standard'
+        self.kernel = None
+        self.jacobian = None
+        self.cache = OrbitCache()
+        self.dtype = np.dtype(np.float64)
+        self.buffers = None
+        self.lastPoints = None
 
-    def setVariables(self, list):
-        self.variables = list
-        for var in self.variables:
-            self.values[var] = 0.0
+    @pyqtSlot(str)
+    def setDtype(self, dtype):
+        if dtype not in DTYPES:
+            logging.error('Unknown dtype %s for map "%s", use one of %s',
+                          dtype, self.name, ', '.join(DTYPES))
+            return
+        self.dtype = np.dtype(dtype)
+        self.buffers = None
 
-    def setConstants(self, list):
-        self.constants = list
-        for var in self.constants:
-            self.values[var] = 0.0
+    def processFunctions(self, funcs):
+        super(StandardMap, self).processFunctions(funcs)
+        self.kernel = None
+        self.jacobian = None
+
+    def getJacobian(self):
+        """Derives the Jacobian symbolically from the parsed expressions.
+        """
+        if self.jacobian is None:
+            self.jacobian = {}
+            for function in ('q', 'p'):
+                for variable in ('q', 'p'):
+                    derivative = self.functions[function].derivative(variable)
+                    logging.info('d%s/d%s = %s', function, variable,
+                                 derivative.source)
+                    self.jacobian[function, variable] = derivative.function
+        return self.jacobian
+
+    def mapBatch(self, q0, p0, steps=None, out=None):
+        """Calculates many orbits at once. All orbits are advanced together,
+        one vectorized step at a time.
+
+        The variables are updated sequentially, i.e., the new value of q is
+        already used when calculating the new value of p.
+
+        Arguments:
+            q0 (array_like): Initial q values of M orbits
+            p0 (array_like): Initial p values of M orbits
+            steps (int): Number of points per orbit. Default :attr:`steps`
+            out (tuple): Two arrays of shape (M, steps) into which the
+                orbits are written, e.g., to reuse them between calls.
+                Default new arrays of :attr:`dtype`
+
+        Returns:
+            tuple: Two arrays q, p of shape (M, steps)
+        """
+        if steps is None:
+            steps = self.steps
+        q0 = np.atleast_1d(np.asarray(q0, dtype=np.float64))
+        p0 = np.atleast_1d(np.asarray(p0, dtype=np.float64))
+
+        with span('StandardMap.mapBatch', q0.size * steps):
+            if self.cache.maxBytes:
+                return self.mapCached(q0, p0, steps, out)
+            return self.calculate(q0, p0,
+                                  *self.orbitArrays(q0.size, steps, out))
+
+    def orbitArrays(self, M, steps, out=None, rows=False):
+        """Returns the arrays of out, or two new arrays of :attr:`dtype`
+        for M orbits of steps points. New arrays are laid out the way the
+        backend writes them fastest, or orbit after orbit with rows.
+        """
+        if out is not None:
+            q, p = out
+            if q.shape != (M, steps) or p.shape != (M, steps):
+                raise ValueError('Output arrays must have shape (%d, %d)'
+                                 % (M, steps))
+            return q, p
+        if rows or self.backend == 'numba':
+            return (np.empty((M, steps), dtype=self.dtype),
+                    np.empty((M, steps), dtype=self.dtype))
+        # The NumPy backend writes one step of all orbits at a time
+        return (np.empty((steps, M), dtype=self.dtype).T,
+                np.empty((steps, M), dtype=self.dtype).T)
+
+    def mapStream(self, q0, p0, steps=None, chunk=STREAM_CHUNK):
+        """Calculates the orbits like :meth:`mapBatch`, but yields them in
+        chunks of at most chunk points of all orbits as they are calculated.
+        Only one chunk is in memory at a time, so any number of orbits of any
+        length can be calculated. The cache is not used.
+
+        Arguments:
+            q0 (array_like): Initial q values of M orbits
+            p0 (array_like): Initial p values of M orbits
+            steps (int): Number of points per orbit. Default :attr:`steps`
+            chunk (int): Maximum number of points of all orbits per chunk.
+                A chunk has at least one point per orbit.
+
+        Yields:
+            tuple: Two arrays q, p of shape (M, n). Together the chunks are
+            the same points as those of :meth:`mapBatch`.
+        """
+        if steps is None:
+            steps = self.steps
+        q = np.atleast_1d(np.asarray(q0, dtype=np.float64))
+        p = np.atleast_1d(np.asarray(p0, dtype=np.float64))
+
+        perChunk = max(1, chunk // q.size)
+        done = 0
+        while done < steps:
+            n = min(perChunk, steps - done)
+            with span('StandardMap.mapStream', q.size * n):
+                # Continued orbits start from the unrounded last point, so
+                # the chunks do not depend on the dtype. The first point is
+                # the last one of the previous chunk.
+                first = 0 if done == 0 else 1
+                chunkQ, chunkP = self.calculate(
+                    q, p, *self.orbitArrays(q.size, n + first))
+                chunkQ, chunkP = chunkQ[:, first:], chunkP[:, first:]
+            q, p = self.lastPoints
+            done += n
+            yield chunkQ, chunkP
+
+    def calculate(self, q0, p0, q, p):
+        """Calculates the orbits into the arrays q and p of shape
+        (M, steps) with the selected backend, bypassing the cache. The last
+        points are also kept in float64 in :attr:`lastPoints`.
+
+        Returns:
+            tuple: The arrays q and p
+        """
+        if self.backend == 'numba':
+            self.lastPoints = self.mapKernel(q0, p0, q, p)
+        else:
+            self.lastPoints = self.mapNumpy(q0, p0, q, p)
+        return q, p
+
+    def cacheKey(self):
+        """Returns the part of the cache keys that identifies the map, i.e.,
+        the expressions, the modulus and the values of the constants.
+        """
+        return (self.functions['q'].source, self.functions['p'].source,
+                self.mod, self.dtype.str) + \
+            tuple(self.values[c] for c in self.constants)
+
+    def mapCached(self, q0, p0, steps, out=None):
+        """Calculates the orbits like :meth:`mapBatch`, but takes them from
+        :attr:`cache` if possible.
+
+        Orbits are keyed by :meth:`cacheKey` and the seed rounded to
+        :data:`~orbit_cache.CACHE_DIGITS` decimals. Orbits that are not
+        cached are calculated together in one batch. Cached orbits with less
+        than steps points are extended together from their last points, the
+        same as if they were calculated in one go. Rounded float32 points
+        cannot be continued exactly, so such orbits are calculated again.
+        """
+        prefix = self.cacheKey()
+        keys = [prefix + (round(q, CACHE_DIGITS), round(p, CACHE_DIGITS))
+                for q, p in zip(q0.tolist(), p0.tolist())]
+        exact = self.dtype == np.float64
+
+        missing = []
+        short = []
+        hits = []
+        for i, key in enumerate(keys):
+            entry = self.cache.get(key)
+            if entry is None or (entry[0].size < steps and not exact):
+                missing.append(i)
+            elif entry[0].size < steps:
+                short.append((i, entry))
+            else:
+                hits.append((i, entry))
+        self.cache.hits += len(hits)
+        self.cache.misses += len(missing)
+        self.cache.extensions += len(short)
+
+        if len(missing) == q0.size:
+            # Nothing cached, so the orbits go directly into the output
+            q, p = self.calculate(q0, p0,
+                                  *self.orbitArrays(q0.size, steps, out))
+        else:
+            # Cached orbits are copied in orbit by orbit
+            q, p = self.orbitArrays(q0.size, steps, out, rows=True)
+        for i, (cachedQ, cachedP) in hits:
+            q[i] = cachedQ[:steps]
+            p[i] = cachedP[:steps]
+        if missing and len(missing) < q0.size:
+            q[missing], p[missing] = self.calculate(
+                q0[missing], p0[missing],
+                *self.orbitArrays(len(missing), steps))
+        if short:
+            shortest = min(entry[0].size for _, entry in short)
+            lastQ = np.array([entry[0][-1] for _, entry in short])
+            lastP = np.array([entry[1][-1] for _, entry in short])
+            extQ, extP = self.calculate(
+                lastQ, lastP, *self.orbitArrays(len(short),
+                                                steps - shortest + 1))
+            for j, (i, (cachedQ, cachedP)) in enumerate(short):
+                n = cachedQ.size
+                q[i, :n] = cachedQ
+                p[i, :n] = cachedP
+                q[i, n:] = extQ[j, 1:steps - n + 1]
+                p[i, n:] = extP[j, 1:steps - n + 1]
+
+        for i in missing + [i for i, _ in short]:
+            self.cache.put(keys[i], q[i].copy(), p[i].copy())
+        return q, p
+
+    def mapNumpy(self, q0, p0, q, p):
+        """Calculates the orbits into q and p with the NumPy backend, see
+        :meth:`calculate`.
+
+        Returns:
+            tuple: The last q and p values in float64
+        """
+        q[:, 0] = q0
+        p[:, 0] = p0
+
+        # Positional arguments of the compiled functions, so no dictionary
+        # is involved inside the loop
+        names = self.variables + self.constants
+        state = [self.values[name] for name in names]
+        iq, ip = names.index('q'), names.index('p')
+        state[iq] = q0
+        state[ip] = p0
+        funcQ = self.functions['q'].function
+        funcP = self.functions['p'].function
+        mod = self.mod
+
+        for i in range(1, q.shape[1]):
+            state[iq] = funcQ(*state) % mod
+            state[ip] = funcP(*state) % mod
+
+            q[:, i] = state[iq]
+            p[:, i] = state[ip]
+
+        return state[iq], state[ip]
+
+    def mapKernel(self, q0, p0, q, p):
+        """Calculates the orbits into q and p with the compiled kernel of
+        the numba backend, see :meth:`calculate`. The kernel is compiled on
+        first use.
+
+        Returns:
+            tuple: The last q and p values in float64
+        """
+        if self.kernel is None:
+            self.kernel = backends.standardKernel(self.functions,
+                                                  self.constants)
+        constants = np.array([self.values[c] for c in self.constants],
+                             dtype=np.float64)
+        lastQ = np.empty(q0.size)
+        lastP = np.empty(p0.size)
+        self.kernel(q0, p0, constants, float(self.mod), q, p, lastQ, lastP)
+        return lastQ, lastP
 
     def map(self):
         """Calculating the next points and values.
 
-        The current values are stored in :attr:`self.values`
+        The current values are stored in :attr:`self.values`. The points are
+        written into :attr:`buffers`, so the returned arrays are only valid
+        until the next call.
         """
 
-        # Create arrays
         logging.info('Calculating the next frame for "%s"', self.name)
-        q = np.zeros(self.steps, dtype=np.float64)
-        p = np.zeros(self.steps, dtype=np.float64)
+        if self.buffers is None or self.buffers[0].shape[1] != self.steps:
+            self.buffers = self.orbitArrays(1, self.steps)
+        q, p = self.mapBatch(self.values['q'], self.values['p'],
+                             out=self.buffers)
 
-        q[0] = self.values['q']
-        p[0] = self.values['p']
+        self.values['q'] = q[0, -1]
+        self.values['p'] = p[0, -1]
 
-        for i in range(1, self.steps):
+        return q[0], p[0]
 
-            self.values['q'] = eval(self.functions['q']) % self.mod
-            self.values['p'] = eval(self.functions['p']) % self.mod
+    def lyapunov(self, q0, p0, steps=None):
+        """Calculates the finite-time maximal Lyapunov exponent of many orbits
+        at once. A tangent vector is propagated with the Jacobian in the same
+        vectorized steps as the orbits and renormalized every step.
 
-            q[i] = self.values['q']
-            p[i] = self.values['p']
+        Regular orbits have exponents close to zero, chaotic ones clearly
+        positive. The tangent map follows the sequential update, i.e., the
+        derivatives of p are evaluated with the new q.
 
-        return q, p
+        Arguments:
+            q0 (array_like): Initial q values of M orbits
+            p0 (array_like): Initial p values of M orbits
+            steps (int): Number of steps. Default :attr:`steps`
+
+        Returns:
+            ndarray: Exponents of the M orbits
+        """
+        if steps is None:
+            steps = self.steps
+        q0 = np.atleast_1d(np.asarray(q0, dtype=np.float64))
+        p0 = np.atleast_1d(np.asarray(p0, dtype=np.float64))
+
+        jacobian = self.getJacobian()
+        Jqq, Jqp = jacobian['q', 'q'], jacobian['q', 'p']
+        Jpq, Jpp = jacobian['p', 'q'], jacobian['p', 'p']
+
+        names = self.variables + self.constants
+        state = [self.values[name] for name in names]
+        iq, ip = names.index('q'), names.index('p')
+        state[iq] = q0
+        state[ip] = p0
+        funcQ = self.functions['q'].function
+        funcP = self.functions['p'].function
+        mod = self.mod
+
+        dq = np.full(q0.size, np.sqrt(0.5))
+        dp = np.full(q0.size, np.sqrt(0.5))
+        total = np.zeros(q0.size)
+
+        for i in range(1, steps):
+            dq = Jqq(*state) * dq + Jqp(*state) * dp
+            state[iq] = funcQ(*state) % mod
+            dp = Jpq(*state) * dq + Jpp(*state) * dp
+            state[ip] = funcP(*state) % mod
+
+            norm = np.hypot(dq, dp)
+            total += np.log(norm)
+            dq /= norm
+            dp /= norm
+
+        return total / max(steps - 1, 1)
+
+    def seedGrid(self, n):
+        """Returns n*n initial values evenly spread over the phase space.
+
+        Arguments:
+            n (int): Number of seeds along each axis
+
+        Returns:
+            tuple: Two flat arrays q0, p0
+        """
+        points = (np.arange(n) + 0.5) * self.mod / n
+        q0, p0 = np.meshgrid(points, points)
+        return q0.ravel(), p0.ravel()
 
 
 class ImageMap(Map):
-    """Maps that play with positional indexes in a NxN (square) image.
+    """Maps that play with positional indexes in a NxM image.
+
+    Rectangular images have a separate modulus per axis, i.e., x is taken
+    modulo N and y modulo M. Alternatively they can be made square when
+    loaded, see :attr:`fit`.
 
     Attributes:
-        baseImage (ndarray): Original image (Matrix with shape (N, N, 3))
-        image (ndarray): Image of current state (map iterations, resizes...)
+        baseImage (ndarray): Original image (Matrix with shape (N, M, 3))
+        image (ndarray): Image of current state (map iterations, resizes...).
+            Either the set image itself or one of :attr:`buffers`, so it is
+            only valid until the next iteration and must not be changed
+        buffers (list): Up to two preallocated working images of the current
+            shape. Iterations gather into the one that does not hold
+            :attr:`image` and swap, so no image is allocated per iteration.
+        moduli (tuple): Modulus of the x and y index, i.e., (N, M)
+        fit (str): How a rectangular image is loaded, one of :data:`FITS`.
+            none keeps it as it is, crop cuts out the centred square and pad
+            centres it on a black square. Default none
+        imageFile (str): Image file from which :attr:`baseImage` is decoded
+            by :meth:`loadImage`
+        cacheDir (str): Directory of the decoded image cache, None disables
+            the cache
+        resizeFilter (str): Filter used by :meth:`resize`, one of
+            :data:`RESIZE_FILTERS`. Default lanczos
+        resized (OrderedDict): The last resized images by size and filter
+        permutation (ndarray): Cached flat gather index of one map iteration
+            for the current size. None until it is first needed.
+        cycles (dict): Cached cycle-length histogram of :attr:`permutation`,
+            mapping cycle length to the number of such cycles.
     """
 
     def __init__(self, parent=None):
         super(ImageMap, self).__init__(parent)
         self.type = 'image'
+        self.imageFile = None
+        self.cacheDir = CACHE_DIR
+        self.resizeFilter = 'lanczos'
+        self.resized = OrderedDict()
         self.baseImage = None
         self.image = None
+        self.buffers = []
         self.shape = (0)
+        self.moduli = (0, 0)
+        self.fit = 'none'
+        self.permutation = None
+        self.cycles = None
+
+    @pyqtSlot(str)
+    def setFit(self, fit):
+        if fit not in FITS:
+            logging.error('Unknown fit %s for map "%s"', fit, self.name)
+            return
+        self.fit = fit
+
+    def setImageFile(self, imageFile):
+        """Sets the image file. The image is only decoded by
+        :meth:`loadImage`, so it can be done later or on another thread.
+        """
+        self.imageFile = imageFile
+
+    def loadImage(self):
+        """Decodes :attr:`imageFile` and sets it as the original image. The
+        decoded array is cached on disk in :attr:`cacheDir` and the original
+        image is memory-mapped read-only from there.
+
+        Returns:
+            ndarray: The decoded image
+        """
+        start = time.perf_counter()
+        logging.info('Reading image %s', self.imageFile)
+        imgArray = fitImage(loadImageArray(self.imageFile, self.cacheDir),
+                            self.fit)
+        logging.info('Setting image.')
+        self.setBaseImage(imgArray)
+        logging.info('Decoded image %s in %.0f ms', self.imageFile,
+                     1000 * (time.perf_counter() - start))
+        return self.baseImage
 
     def setBaseImage(self, img):
         """Sets the original image or matrix.
         """
         self.baseImage = img
+        self.resized.clear()
 
         self.setImage(self.baseImage)
 
 
     def setImage(self, img):
-        """Sets a new image to the :attr:`image`. There are two copies of the
-        image or matrix. An original one and the one on which we perform
-        transformations.
+        """Sets a new image to the :attr:`image`. The image is not copied,
+        it may be a read-only memory map of the cache or a cached resized
+        image. Transformations never change it, they write into the working
+        :attr:`buffers`, which are kept as long as the shape stays the same.
 
-        Also the modulus value is set to the new size of the image.
+        Also the modulus values are set to the new size of the image.
         """
-        self.image = np.array(img, copy=True)
+        self.image = img
+        if img.shape != self.shape or \
+                any(b.dtype != img.dtype for b in self.buffers):
+            self.buffers = []
         self.shape = self.image.shape
         self.setMod(self.shape[0]) # Setting mod to the size or matrix.
+        self.moduli = self.shape[:2]
+        self.permutation = None  # Only valid for the previous size.
+        self.cycles = None
+
+    def mapIndexes(self, start=0, stop=None):
+        """Evaluate the map functions on the whole grid of pixel indexes at
+        once, instead of pixel by pixel.
+
+        Arguments:
+            start (int): First row of the evaluated block
+            stop (int): End of the evaluated block. Default all rows
+
+        Returns:
+            tuple: Two integer arrays of shape (stop - start, M). Pixel
+            (i, j) of the next frame is taken from pixel
+            (newX[i - start, j], newY[i - start, j]) of the current one.
+        """
+        if stop is None:
+            stop = self.shape[0]
+        x, y = np.indices((stop - start, self.shape[1]))
+        x += start
+        values = dict(self.values, x=x, y=y)
+        newX = self.evaluate('x', values) % self.moduli[0]
+        newY = self.evaluate('y', values) % self.moduli[1]
+        return newX, newY
+
+    def getPermutation(self):
+        """Returns the flat gather index of one map iteration. For a given
+        size the index never changes, so it is evaluated once and cached
+        until the image is resized or replaced.
+
+        The functions are evaluated in blocks of about :data:`INDEX_BLOCK`
+        pixels, so the temporary arrays of the evaluation stay small even for
+        large images.
+
+        Returns:
+            ndarray: Flat index with N*M elements, so that the next frame is
+            ``image.flat[permutation]`` (per pixel).
+        """
+        if self.permutation is None:
+            logging.info('Calculating permutation for "%s" of size %dx%d',
+                         self.name, *self.moduli)
+            rows, columns = self.shape[:2]
+            permutation = np.empty(rows * columns, dtype=np.intp)
+            block = max(1, INDEX_BLOCK // columns)
+            for start in range(0, rows, block):
+                stop = min(start + block, rows)
+                newX, newY = self.mapIndexes(start, stop)
+                permutation[start * columns:stop * columns] = \
+                    np.ravel_multi_index((newX, newY), (rows, columns)).ravel()
+            self.permutation = permutation
+        return self.permutation
+
+    def isPermutation(self):
+        """Checks if the map is a bijection of the pixels, i.e., every pixel
+        is taken exactly once.
+        """
+        counts = np.bincount(self.getPermutation(),
+                             minlength=self.permutation.size)
+        return bool(np.all(counts == 1))
+
+    def permutationPower(self, n):
+        """Composes the permutation with itself by repeated squaring, so that
+        a jump of n iterations costs O(log n) index gathers.
+
+        Arguments:
+            n (int): Number of iterations. Negative values use the inverse
+                permutation, which only exists if the map is a bijection.
+
+        Returns:
+            ndarray: Flat gather index of n map iterations. It may be the
+            cached permutation itself, so it must not be changed.
+        """
+        base = self.getPermutation()
+        if n < 0:
+            if not self.isPermutation():
+                raise ValueError('Map "%s" is not invertible.' % self.name)
+            inverse = np.empty_like(base)
+            inverse[base] = np.arange(base.size, dtype=base.dtype)
+            base = inverse
+            n = -n
+
+        if n == 0:
+            return np.arange(base.size, dtype=base.dtype)
+        result = None
+        while n:
+            if n & 1:
+                result = base if result is None else result[base]
+            n >>= 1
+            if n:
+                base = base[base]
+        return result
+
+    def cycleLabels(self):
+        """Labels every pixel with the smallest flat index on its cycle.
+
+        The labels are propagated by pointer jumping: in round k each pixel
+        takes the minimum label over the next 2**k pixels on its cycle. Every
+        round is a couple of whole-array gathers, so the cost is
+        O(N**2 log L) for the longest cycle length L and the memory stays at
+        a few index arrays of N**2 elements.
+
+        Returns:
+            ndarray: Flat array of N*N labels.
+        """
+        if not self.isPermutation():
+            raise ValueError('Map "%s" is not a permutation of the pixels.'
+                             % self.name)
+
+        perm = self.getPermutation()
+        # Halve the memory of the index arrays when possible
+        dtype = np.int32 if perm.size < 2**31 else np.int64
+        perm = perm.astype(dtype)
+        jump = perm
+        labels = np.arange(perm.size, dtype=dtype)
+        while True:
+            np.minimum(labels, labels[jump], out=labels)
+            # Converged when the label is constant along every cycle
+            if np.array_equal(labels, labels[perm]):
+                return labels
+            jump = jump[jump]
+
+    def cycleStructure(self):
+        """Decomposes the pixel permutation into cycles.
+
+        Returns:
+            dict: Cycle-length histogram, mapping each cycle length to the
+            number of cycles of that length.
+        """
+        if self.cycles is None:
+            logging.info('Calculating cycle structure for "%s" of size '
+                         '%dx%d', self.name, *self.moduli)
+            counts = np.bincount(self.cycleLabels())
+            lengths, number = np.unique(counts[counts > 0],
+                                        return_counts=True)
+            self.cycles = {int(l): int(n) for l, n in zip(lengths, number)}
+            logging.info('Cycle structure of "%s": %s', self.name,
+                         self.cycles)
+        return self.cycles
+
+    def period(self):
+        """Returns the number of iterations after which the image comes back,
+        i.e., the least common multiple of all the cycle lengths.
+        """
+        period = 1
+        for length in self.cycleStructure():
+            period = period * length // math.gcd(period, length)
+        return period
+
+    def gathered(self, img, index, out=None):
+        """Applies the flat gather index to img, which has the shape of the
+        current image.
+
+        Arguments:
+            img (ndarray): Source image
+            index (ndarray): Flat gather index
+            out (ndarray): Contiguous image of the same shape into which the
+                result is written. Must not be img. Default a new image
+
+        Returns:
+            ndarray: The gathered image
+        """
+        pixels = self.shape[0] * self.shape[1]
+        flat = img.reshape((pixels,) + self.shape[2:])
+        if out is None:
+            return np.take(flat, index, axis=0).reshape(self.shape)
+        # Indexes are always valid, and without raise mode np.take writes
+        # into out directly instead of through a temporary copy
+        np.take(flat, index, axis=0, out=out.reshape(flat.shape),
+                mode='clip')
+        return out
+
+    def workingBuffer(self):
+        """Returns the working buffer that does not hold the current image,
+        allocating it on first use.
+        """
+        for buffer in self.buffers:
+            if buffer is not self.image:
+                return buffer
+        buffer = np.empty(self.shape, dtype=self.image.dtype)
+        self.buffers.append(buffer)
+        return buffer
+
+    def gather(self, index):
+        """Applies a flat gather index to the current image. The result is
+        written into the other working buffer, which then becomes the current
+        image.
+        """
+        self.image = self.gathered(self.image, index, self.workingBuffer())
 
     def map(self):
         """Perform the mapping on the current image. This means "shifting" the
         indexes of each pixel around as set in the json file.
         The attribute :attr:`image` is being changed.
 
+        The cached permutation is applied with a single gather, which works
+        for grayscale (N, N) and colour (N, N, 3) images alike.
+
         Returns nothing as changes are done to the :attr:`image`.
         """
-        newImage = np.zeros(self.shape, dtype=np.uint8)
-        for i in range(self.mod):
-            for j in range(self.mod):
-                x, y = i, j
-                new_X = eval(self.functions['x']) % self.mod
-                new_Y = eval(self.functions['y']) % self.mod
-                newImage[i][j] = self.image[new_X][new_Y]
+        with span('ImageMap.map', self.shape[0] * self.shape[1]):
+            self.gather(self.getPermutation())
+
+    def iterate(self, n):
+        """Performs n iterations of the map at once on the current image.
+
+        Arguments:
+            n (int): Number of iterations. Can be negative for bijective maps.
+                Once the period is known, only the phase n modulo period is
+                performed.
+        """
+        logging.info('Performing %d iterations on "%s"', n, self.name)
+        if self.cycles is not None:
+            # Only the phase within the period matters
+            n %= self.period()
+        if n == 0:
+            return
+        with span('ImageMap.iterate', self.shape[0] * self.shape[1]):
+            self.gather(self.permutationPower(n))
+
+    def frames(self, iterations, every=1, inPlace=False):
+        """Generates the frames of the next iterations, without changing the
+        current image. Every frame is a new array, so frames can be kept
+        while the next ones are calculated.
 
-        self.image = newImage
+        Arguments:
+            iterations (int): Number of iterations
+            every (int): Only every n-th iteration is generated. The last
+                iteration is always generated.
+            inPlace (bool): Iterate the current image in its working
+                buffers instead, without allocating frames. Every frame is
+                then only valid until the next one is generated.
+
+        Yields:
+            tuple: Iteration, counted from the current image, and its image.
+            The first frame is the current image itself.
+        """
+        index = self.permutationPower(every)
+        img = self.image
+        iteration = 0
+        yield iteration, img
+        while iteration < iterations:
+            step = min(every, iterations - iteration)
+            if step != every:
+                index = self.permutationPower(step)
+            if inPlace:
+                self.gather(index)
+                img = self.image
+            else:
+                img = self.gathered(img, index)
+            iteration += step
+            yield iteration, img
 
     def resize(self, newSize):
         """Change the dimension of the image. In this case the argument is the
         new size of the image matrix.
 
         The resize is done on the original image, so as to not lose pixel
-        information.
+        information. It uses the C resampler of Pillow with the filter set in
+        :attr:`resizeFilter` and the output always has exactly the requested
+        shape. Resized images are cached per size and filter, so going back
+        to a previous size is instant.
 
         Arguments:
-            newSize (int): New size for resizing the image.
+            newSize (int or tuple): New size for resizing the image. A single
+                number is the new number of rows, the columns follow the
+                aspect ratio of the original image, i.e., square images
+                become (newSize, newSize). A tuple is the exact (rows,
+                columns).
         """
+        if np.ndim(newSize) == 0:
+            rows, columns = self.baseImage.shape[:2]
+            newSize = (newSize, max(1, int(round(columns * newSize / rows))))
+        newSize = tuple(int(n) for n in newSize)
+
+        with span('ImageMap.resize', newSize[0] * newSize[1]):
+            key = (newSize, self.resizeFilter)
+            if key in self.resized:
+                self.resized.move_to_end(key)
+                logging.info('Using cached %dx%d image', *newSize)
+            else:
+                from PIL import Image
+
+                start = time.perf_counter()
+                resample = getattr(Image, RESIZE_FILTERS[self.resizeFilter])
+                img = Image.fromarray(np.ascontiguousarray(self.baseImage))
+                # Pillow sizes are (width, height)
+                img = img.resize(newSize[::-1], resample=resample)
+                resized = np.asarray(img, dtype=np.uint8)
+                resized.flags.writeable = False
+                self.resized[key] = resized
+                if len(self.resized) > RESIZE_CACHE:
+                    self.resized.popitem(last=False)
+                logging.info('Resized image to %dx%d with %s filter in '
+                             '%.0f ms', newSize[0], newSize[1],
+                             self.resizeFilter,
+                             1000 * (time.perf_counter() - start))
+
+            self.setImage(self.resized[key])
 
-        size = int((newSize / self.baseImage.shape[0]) * 100)
-
-        self.setImage(imresize(self.baseImage, size))
+    @pyqtSlot(str)
+    def setResizeFilter(self, name):
+        if name not in RESIZE_FILTERS:
+            logging.error('Unknown resize filter %s', name)
+            return
+        self.resizeFilter = name
 
     def reset(self):
         """Resets the attribute :attr:`image` to the original image.
         """
-        self.setImage(self.baseImage)
+        with span('ImageMap.reset') as measured:
+            self.setImage(self.baseImage)
+            measured.work = self.shape[0] * self.shape[1]
@@ -0,0 +1,185 @@
+"""Module for timing the hot paths of the maps and the user interface.
+
+Code that should be measured is wrapped in a :func:`span` or decorated with
+:func:`timed`, which record its duration and the amount of work done, e.g.,
+pixels or points. The last few hundred durations of every span are kept, so
+the statistics always describe the recent behaviour. Spans are recorded from
+the main and the worker threads.
+
+The module does not depend on Qt. The :class:`Profiler` can additionally
+collect a cProfile of the main thread and of the jobs of the worker threads.
+"""
+
+from collections import OrderedDict, deque
+
+import cProfile
+import functools
+import pstats
+import threading
+import time
+
+import numpy as np
+
+
+class Span(object):
+    """Context manager that records its duration in :class:`Metrics`.
+
+    Attributes:
+        name (str): Name of the measured code
+        work (int): Amount of work done, can be set inside the span when it
+            is not known in advance
+    """
+
+    def __init__(self, metrics, name, work=0):
+        self.metrics = metrics
+        self.name = name
+        self.work = work
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start,
+                            self.work)
+        return False
+
+
+class Metrics(object):
+    """Rolling window of durations for every span name.
+
+    Attributes:
+        window (int): Number of durations kept per name
+        spans (OrderedDict): Deques of (seconds, work) per name
+    """
+
+    def __init__(self, window=256):
+        self.window = window
+        self.spans = OrderedDict()
+        self.lock = threading.Lock()
+
+    def span(self, name, work=0):
+        return Span(self, name, work)
+
+    def record(self, name, seconds, work=0):
+        with self.lock:
+            if name not in self.spans:
+                self.spans[name] = deque(maxlen=self.window)
+            self.spans[name].append((seconds, work))
+
+    def statistics(self):
+        """Returns the statistics of the recorded spans.
+
+        Returns:
+            OrderedDict: For every span name a dict with the number of
+            recorded calls (count), the median and 95th percentile of the
+            duration in seconds (p50, p95) and the work per second while the
+            span was running (rate, 0 without work).
+        """
+        with self.lock:
+            spans = [(name, list(values)) for name, values in
+                     self.spans.items()]
+
+        statistics = OrderedDict()
+        for name, values in spans:
+            seconds, work = np.array(values, dtype=np.float64).T
+            total = seconds.sum()
+            statistics[name] = {
+                'count': seconds.size,
+                'p50': float(np.percentile(seconds, 50)),
+                'p95': float(np.percentile(seconds, 95)),
+                'rate': float(work.sum() / total) if total > 0 else 0.0}
+        return statistics
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+
+class Profiler(object):
+    """Collects a cProfile of the main thread and of every job passed through
+    :meth:`profile` while it is running.
+
+    Attributes:
+        profiles (list): Profiles of the current run, the first one is the
+            one of the main thread
+        running (bool): Profiling is switched on
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self.running = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        profile = cProfile.Profile()
+        profile.enable()
+        self.profiles = [profile]
+        self.running = True
+
+    def profile(self, function, *args):
+        """Calls function(*args), profiled if the profiler is running.
+        """
+        if not self.running:
+            return function(*args)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Since python 3.12 the main profile already covers all threads
+            return function(*args)
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def stop(self, fileName=None):
+        """Stops profiling and writes the merged profiles into fileName,
+        which can be read with :mod:`pstats` or snakeviz.
+
+        Returns:
+            pstats.Stats: The merged profiles
+        """
+        self.running = False
+        self.profiles[0].disable()
+        with self.lock:
+            stats = pstats.Stats(*self.profiles)
+            self.profiles = []
+        if fileName:
+            stats.dump_stats(fileName)
+        return stats
+
+
+METRICS = Metrics()
+PROFILER = Profiler()
+
+
+def span(name, work=0):
+    """Measures the code in a with block in the global :data:`METRICS`.
+
+    Example:
+        with span('ImageMap.map', pixels):
+            ...
+    """
+    return METRICS.span(name, work)
+
+
+def timed(name, work=None):
+    """Decorator that measures every call of a function in a :func:`span`.
+
+    Arguments:
+        name (str): Name of the span
+        work (function): Called with the arguments of the decorated function
+            and returns the amount of work of the call
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            amount = 0 if work is None else work(*args, **kwargs)
+            with METRICS.span(name, amount):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
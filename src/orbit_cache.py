@@ -0,0 +1,81 @@
+"""Module that caches calculated orbits of standard maps in memory.
+
+Clicking on the same island again, with the same constants, asks for an
+orbit that was already calculated. Orbits are kept in a least recently used
+cache that is bounded by the bytes of the stored arrays, and an orbit that
+is asked for with more steps than cached is extended from its last point
+instead of being calculated again.
+"""
+
+from collections import OrderedDict
+
+import logging
+
+CACHE_BYTES = 64 * 2**20
+CACHE_DIGITS = 12  # Seeds that agree to this many decimals share an orbit
+
+
+class OrbitCache(object):
+    """Least recently used cache of orbits, bounded by the number of bytes.
+
+    Attributes:
+        maxBytes (int): Upper bound of :attr:`size`, 0 disables the cache
+        entries (OrderedDict): q and p arrays of every key, the least
+            recently used one first
+        size (int): Bytes of all stored arrays
+        hits (int): Number of orbits taken completely from the cache
+        misses (int): Number of orbits not in the cache
+        extensions (int): Number of cached orbits that had to be extended
+    """
+
+    def __init__(self, maxBytes=CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the q and p arrays of the key, None if not cached.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, q, p):
+        """Stores the orbit and evicts the least recently used ones until
+        the cache fits into :attr:`maxBytes`. Orbits larger than the whole
+        cache are not stored.
+        """
+        self.discard(key)
+        nbytes = q.nbytes + p.nbytes
+        if nbytes > self.maxBytes:
+            return
+        while self.size + nbytes > self.maxBytes:
+            _, (oldQ, oldP) = self.entries.popitem(last=False)
+            self.size -= oldQ.nbytes + oldP.nbytes
+        self.entries[key] = (q, p)
+        self.size += nbytes
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[0].nbytes + entry[1].nbytes
+
+    def resize(self, maxBytes):
+        """Changes the bound and evicts orbits that do not fit anymore.
+        """
+        self.maxBytes = maxBytes
+        while self.entries and self.size > self.maxBytes:
+            _, (oldQ, oldP) = self.entries.popitem(last=False)
+            self.size -= oldQ.nbytes + oldP.nbytes
+        logging.info('Orbit cache bound set to %d bytes', maxBytes)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,110 @@
+"""Module with the data structures behind the plots of the maps.
+
+The classes here only hold NumPy arrays and do not depend on Qt or
+matplotlib, so they can be used by the user interface and in batch jobs.
+"""
+
+import numpy as np
+
+
+class PointBuffer(object):
+    """Growable buffer of (x, y) points with one value per point, i.e., the
+    colour index of the orbit.
+
+    The points are stored in one preallocated array, whose capacity doubles
+    when it is full, so appending is amortized O(1) and the whole buffer can
+    back a single scatter plot.
+
+    Attributes:
+        points (ndarray): Storage of shape (capacity, 2)
+        values (ndarray): Storage of shape (capacity,)
+        size (int): Number of stored points
+    """
+
+    def __init__(self, capacity=65536, dtype=np.float64):
+        self.points = np.empty((capacity, 2), dtype=dtype)
+        self.values = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def reserve(self, capacity):
+        """Makes sure that the buffer can hold capacity points.
+        """
+        if capacity <= self.points.shape[0]:
+            return
+        newCapacity = max(capacity, 2 * self.points.shape[0])
+        points = np.empty((newCapacity, 2), dtype=self.points.dtype)
+        values = np.empty(newCapacity, dtype=self.values.dtype)
+        points[:self.size] = self.points[:self.size]
+        values[:self.size] = self.values[:self.size]
+        self.points = points
+        self.values = values
+
+    def append(self, x, y, value=0):
+        """Appends points.
+
+        Arguments:
+            x (array_like): x coordinates
+            y (array_like): y coordinates, same shape as x
+            value (array_like): Value of every point or one value for all
+
+        Returns:
+            slice: Position of the new points inside the buffer
+        """
+        x = np.ravel(x)
+        y = np.ravel(y)
+        start = self.size
+        end = start + x.size
+        self.reserve(end)
+        self.points[start:end, 0] = x
+        self.points[start:end, 1] = y
+        self.values[start:end] = np.ravel(value) if np.ndim(value) else value
+        self.size = end
+        return slice(start, end)
+
+    def offsets(self, index=slice(None)):
+        """Returns a view of the stored points with shape (size, 2).
+        """
+        return self.points[:self.size][index]
+
+    def colours(self, index=slice(None)):
+        """Returns a view of the stored values.
+        """
+        return self.values[:self.size][index]
+
+    def clear(self):
+        self.size = 0
+
+
+class DensityRaster(object):
+    """Two dimensional histogram of points over the square [0, mod)^2.
+
+    Points are binned as they arrive and only the counts are kept, so the
+    memory stays constant no matter how many points are added.
+
+    Attributes:
+        bins (int): Resolution along each axis
+        mod (float): Size of the square
+        counts (ndarray): Counts of shape (bins, bins), indexed [y, x] so it
+            can be shown directly as an image
+        total (int): Number of added points
+    """
+
+    def __init__(self, mod, bins=512):
+        self.mod = mod
+        self.bins = bins
+        self.counts = np.zeros((bins, bins), dtype=np.int64)
+        self.total = 0
+
+    def add(self, x, y):
+        """Bins the points and adds them to :attr:`counts`.
+        """
+        scale = self.bins / self.mod
+        ix = np.clip((np.ravel(x) * scale).astype(np.intp), 0, self.bins - 1)
+        iy = np.clip((np.ravel(y) * scale).astype(np.intp), 0, self.bins - 1)
+        flat = np.bincount(iy * self.bins + ix, minlength=self.bins ** 2)
+        self.counts += flat.reshape(self.bins, self.bins)
+        self.total += ix.size
+
+    def clear(self):
+        self.counts[:] = 0
+        self.total = 0
@@ -0,0 +1,209 @@
+"""Module that stores the orbits of standard maps on disk.
+
+A session is a directory with one .npy file per chunk of orbits, i.e., per
+calculation of the tab, and a meta.json that describes the chunks: the
+values of the constants and the shape. The seeds are the first points of
+the chunks. Chunks are only ever appended, each with a single write, and
+they are read back memory-mapped, so sessions with tens of millions of
+points can be shown again without recalculating and without loading
+everything into memory at once.
+
+Sessions are bounded by :data:`SESSION_BYTES`: a session stops storing
+orbits once it reaches the bound, and when a new session starts, the least
+recently changed old sessions are deleted until all of them together fit
+into the bound. The directory of a session is only created with its first
+chunk, so sessions without orbits leave nothing behind.
+
+A whole session can also be exported into a single .npz archive.
+"""
+
+import json
+import logging
+import os
+import itertools
+import shutil
+import time
+
+import numpy as np
+
+from src.image_cache import CACHE_DIR
+
+SESSION_DIR = os.path.join(CACHE_DIR, 'sessions')
+SESSION_BYTES = 512 * 2**20
+
+_sessionIds = itertools.count()
+
+
+def directorySize(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory)
+               if entry.is_file())
+
+
+def pruneSessions(root, maxBytes=SESSION_BYTES):
+    """Deletes the least recently changed sessions in root until the others
+    fit into maxBytes together, and directories without any chunk.
+    """
+    sessions = [entry.path for entry in os.scandir(root) if entry.is_dir()]
+    sessions.sort(key=os.path.getmtime, reverse=True)
+    total = 0
+    for directory in sessions:
+        size = directorySize(directory)
+        total += size
+        if size == 0:
+            # Fails if a chunk was written in the meantime
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        elif total > maxBytes:
+            logging.info('Deleting old session %s', directory)
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def newSessionDir(mapName):
+    """Names a new directory for a session of the map inside
+    :data:`SESSION_DIR`, after pruning the old sessions. The directory is
+    created by :meth:`OrbitStore.append` with the first chunk.
+
+    Returns:
+        str: The new directory
+    """
+    root = os.path.expanduser(SESSION_DIR)
+    if os.path.isdir(root):
+        pruneSessions(root)
+    name = ''.join(c if c.isalnum() else '_' for c in mapName)
+    while True:
+        # Unique even for several sessions within a second and processes
+        directory = os.path.join(root, '%s-%s-%d-%d' % (
+            name, time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+            next(_sessionIds)))
+        if not os.path.exists(directory):
+            return directory
+
+
+class OrbitStore(object):
+    """Orbits of one standard map stored in chunks on disk.
+
+    If the directory already contains a session, it is reopened and new
+    chunks are appended to it.
+
+    Attributes:
+        directory (str): Directory of the session
+        meta (dict): Name and modulus of the map and a list with the
+            description of every chunk (file, constants, orbits, steps)
+        maxBytes (int): Chunks that would make the session larger are not
+            stored anymore
+        size (int): Bytes of the stored chunks
+    """
+
+    META = 'meta.json'
+
+    def __init__(self, directory, mapName='', mod=1.0,
+                 maxBytes=SESSION_BYTES):
+        self.directory = directory
+        self.meta = {'map': mapName, 'mod': mod, 'chunks': []}
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.full = False
+        metaFile = os.path.join(directory, self.META)
+        if os.path.exists(metaFile):
+            with open(metaFile) as f:
+                self.meta = json.load(f)
+            self.size = sum(
+                os.path.getsize(os.path.join(directory, chunk['file']))
+                for chunk in self.meta['chunks'])
+
+    def __len__(self):
+        return len(self.meta['chunks'])
+
+    @property
+    def points(self):
+        """Total number of stored points.
+        """
+        return sum(c['orbits'] * c['steps'] for c in self.meta['chunks'])
+
+    def append(self, q, p, constants):
+        """Appends a chunk of orbits, unless the session would grow beyond
+        :attr:`maxBytes`.
+
+        Arguments:
+            q (ndarray): q values of shape (M, steps), the first column are
+                the seeds
+            p (ndarray): p values of the same shape
+            constants (dict): Values of the constants of the orbits
+
+        Returns:
+            bool: The chunk was stored
+        """
+        if self.size + q.nbytes + p.nbytes > self.maxBytes:
+            if not self.full:
+                logging.warning('Session %s reached %d bytes, further orbits '
+                                'are not stored', self.directory,
+                                self.maxBytes)
+                self.full = True
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        name = 'chunk_%06d.npy' % len(self.meta['chunks'])
+        fileName = os.path.join(self.directory, name)
+        np.save(fileName, np.stack((q, p)))
+        self.size += os.path.getsize(fileName)
+        self.meta['chunks'].append({
+            'file': name,
+            'orbits': q.shape[0],
+            'steps': q.shape[1],
+            'constants': {k: float(v) for k, v in constants.items()}})
+        self.writeMeta()
+        return True
+
+    def writeMeta(self):
+        # Replacing the file keeps the old meta intact if writing fails
+        metaFile = os.path.join(self.directory, self.META)
+        with open(metaFile + '.tmp', 'w') as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(metaFile + '.tmp', metaFile)
+
+    def chunk(self, index):
+        """Returns the chunk as read-only memory map of shape (2, M, steps).
+        """
+        fileName = os.path.join(self.directory,
+                                self.meta['chunks'][index]['file'])
+        return np.load(fileName, mmap_mode='r')
+
+    def orbits(self):
+        """Yields the q and p arrays of every chunk, memory-mapped.
+        """
+        for i in range(len(self)):
+            q, p = self.chunk(i)
+            yield q, p
+
+    def export(self, fileName):
+        """Writes the meta data and all chunks into one .npz archive, which
+        can be read with :func:`readOrbits`.
+        """
+        logging.info('Exporting %d points to %s', self.points, fileName)
+        arrays = {'chunk_%06d' % i: self.chunk(i) for i in range(len(self))}
+        np.savez(fileName, meta=np.array(json.dumps(self.meta)), **arrays)
+
+
+def readOrbits(path):
+    """Opens a session directory or an exported .npz archive.
+
+    Returns:
+        tuple: The meta data of the session and a generator of the q and p
+        arrays of every chunk. Chunks of sessions are memory-mapped, chunks
+        of archives are read one at a time.
+    """
+    if os.path.isdir(path):
+        store = OrbitStore(path)
+        return store.meta, store.orbits()
+
+    archive = np.load(path)
+    meta = json.loads(str(archive['meta']))
+
+    def orbits():
+        with archive:
+            for i in range(len(meta['chunks'])):
+                q, p = archive['chunk_%06d' % i]
+                yield q, p
+
+    return meta, orbits()
@@ -0,0 +1,166 @@
+"""Module for parameter sweeps of standard maps.
+
+A sweep calculates the same seeds for every combination of constant values
+on a grid, e.g., K from 0 to 2, and aggregates the results into one array.
+The parameter points are independent, so they are distributed over a pool of
+processes, each of which loads the map from its json file only once.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import itertools
+import logging
+import os
+
+import numpy as np
+
+from src.loader import loadMap
+from src.render import DensityRaster
+
+# Map of the worker process, loaded once by _initWorker
+_MAP = None
+
+
+def parameterGrid(ranges):
+    """Returns all combinations of the constant values.
+
+    Arguments:
+        ranges (dict): Sequence of values for each constant name
+
+    Returns:
+        list: One dictionary of constant values per parameter point. The
+        last constant changes fastest.
+    """
+    names = list(ranges)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[ranges[n] for n in names])]
+
+
+def parseRange(text):
+    """Parses NAME=START:STOP:NUM into the name and NUM evenly spaced values
+    from START to STOP inclusive, or NAME=VALUE into a single value.
+    """
+    name, values = text.split('=', 1)
+    parts = [float(v) for v in values.split(':')]
+    if len(parts) == 1:
+        return name, np.array(parts)
+    start, stop, num = parts
+    return name, np.linspace(start, stop, int(num))
+
+
+def _initWorker(mapFile, backend, dtype):
+    global _MAP
+    logging.getLogger().setLevel(logging.WARNING)
+    _MAP = loadMap(mapFile)
+    _MAP.cache.resize(0)  # Every point has other constants
+    if backend is not None:
+        _MAP.setBackend(backend)
+    if dtype is not None:
+        _MAP.setDtype(dtype)
+
+
+def _runPoint(index, constants, q0, p0, steps, bins):
+    _MAP.values.update(constants)
+    q, p = _MAP.mapBatch(q0, p0, steps)
+    if bins is None:
+        return index, np.stack((q, p))
+    raster = DensityRaster(_MAP.mod, bins)
+    raster.add(q, p)
+    return index, raster.counts
+
+
+def sweep(mapFile, ranges, q0, p0, steps=None, bins=None, workers=None,
+          backend=None, output=None, progress=None, cancel=None, dtype=None):
+    """Calculates the orbits of the seeds for every point of the parameter
+    grid on a pool of processes.
+
+    Arguments:
+        mapFile (str): json file of a standard map
+        ranges (dict): Sequence of values for each swept constant
+        q0 (array_like): Initial q values of the M seeds
+        p0 (array_like): Initial p values of the M seeds
+        steps (int): Number of points per orbit. Default from the map
+        bins (int): If set, every parameter point is reduced to a density
+            raster of shape (bins, bins) instead of returning all points
+        workers (int): Number of processes. Default is the number of CPUs
+        backend (str): Calculation backend of the workers
+        output (str): If set, the results are written into this .npy file
+            as they arrive, instead of being kept in memory
+        progress (function): Called as progress(done, total) after every
+            finished parameter point
+        cancel (threading.Event): Stops the sweep when set. Points that
+            were not calculated stay zero.
+        dtype (str): Type of the stored orbits, one of
+            :data:`~maps.DTYPES`. Default from the map
+
+    Returns:
+        tuple: The list of parameter points from :func:`parameterGrid` and
+        the aggregated array of shape (points, 2, M, steps), or
+        (points, bins, bins) with bins.
+    """
+    points = parameterGrid(ranges)
+    m = loadMap(mapFile)
+    if m is None or m.type != 'standard':
+        raise ValueError('Sweeps need a standard map, got %s' % mapFile)
+    unknown = set(ranges) - set(m.constants)
+    if unknown:
+        raise ValueError('Unknown constants %s' % ', '.join(sorted(unknown)))
+    if dtype is not None:
+        m.setDtype(dtype)
+
+    q0 = np.atleast_1d(np.asarray(q0, dtype=np.float64))
+    p0 = np.atleast_1d(np.asarray(p0, dtype=np.float64))
+    if steps is None:
+        steps = m.steps
+    if bins is None:
+        shape, resultDtype = (len(points), 2, q0.size, steps), m.dtype
+    else:
+        shape, resultDtype = (len(points), bins, bins), np.int64
+
+    if output is not None:
+        result = np.lib.format.open_memmap(output, mode='w+',
+                                           dtype=resultDtype, shape=shape)
+    else:
+        result = np.zeros(shape, dtype=resultDtype)
+
+    workers = workers or os.cpu_count()
+    logging.info('Sweeping %d parameter points of "%s" on %d processes',
+                 len(points), m.name, workers)
+
+    tasks = iter(enumerate(points))
+    done = 0
+    with ProcessPoolExecutor(workers, initializer=_initWorker,
+                             initargs=(mapFile, backend, dtype)) as executor:
+        pending = set()
+        while True:
+            # Only a few points per process are submitted at a time, so
+            # cancelling is quick and finished results do not pile up
+            while len(pending) < 2 * workers and \
+                    not (cancel is not None and cancel.is_set()):
+                task = next(tasks, None)
+                if task is None:
+                    break
+                index, constants = task
+                pending.add(executor.submit(_runPoint, index, constants, q0,
+                                            p0, steps, bins))
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index, data = future.result()
+                result[index] = data
+                done += 1
+                if progress is not None:
+                    progress(done, len(points))
+
+            if cancel is not None and cancel.is_set():
+                for future in pending:
+                    future.cancel()
+                logging.info('Sweep cancelled after %d of %d points', done,
+                             len(points))
+                break
+
+    if output is not None:
+        result.flush()
+    return points, result
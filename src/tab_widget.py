@@ -1,28 +1,101 @@
-from PyQt5.QtCore import pyqtSlot, QTimer
+from PyQt5.QtCore import pyqtSlot, pyqtSignal, QTimer, Qt
+from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtWidgets import (QWidget, QSizePolicy, QGroupBox, QGridLayout,
                              QLabel, QDoubleSpinBox, QSpacerItem,
-                             QPushButton, QSpinBox)
+                             QPushButton, QSpinBox, QComboBox, QCheckBox,
+                             QStackedWidget, QFileDialog, QTableWidget,
+                             QTableWidgetItem, QHeaderView)
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as \
     FigureCanvas
+from matplotlib.colors import LogNorm, Normalize
 from matplotlib.figure import Figure
 
 import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from src.backends import BACKENDS
+from src.export import FORMATS as EXPORT_FORMATS, exportFrames
+from src.maps import RESIZE_FILTERS
+from src.metrics import METRICS, PROFILER, timed
+from src.render import PointBuffer, DensityRaster
+from src.store import SESSION_DIR, OrbitStore, newSessionDir, readOrbits
+from src.worker import MapRunner
 
 
 class MplCanvas(FigureCanvas):
     """QWidget and FigureCanvasAgg.
+
+    Attributes:
+        beforeDraw (list): Functions called before every full redraw, e.g.,
+            to update artists that are too expensive to update more often
     """
 
     def __init__(self):
         # Figsize is default 4, 5
         self.fig = Figure(figsize=(4, 5), dpi=100)
         self.axes = self.fig.add_subplot(111)
+        self.beforeDraw = []
         super(MplCanvas, self).__init__(self.fig)
 
         self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.updateGeometry()
 
+    @timed('MplCanvas.draw')
+    def draw(self):
+        """Full redraw of the figure.
+        """
+        for function in self.beforeDraw:
+            function()
+        super(MplCanvas, self).draw()
+
+
+class PixelView(QLabel):
+    """Shows an image matrix directly as a QImage, skipping matplotlib
+    entirely. The image is scaled to the size of the widget without
+    interpolation, so every pixel of the map stays visible.
+    """
+    clicked = pyqtSignal()
+
+    FORMATS = {1: QImage.Format_Grayscale8,
+               3: QImage.Format_RGB888,
+               4: QImage.Format_RGBA8888}
+
+    def __init__(self, parent=None):
+        super(PixelView, self).__init__(parent)
+        self.setAlignment(Qt.AlignCenter)
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.qimage = None
+        self.data = None
+
+    def setImage(self, img):
+        """Sets the image matrix with shape (N, M), (N, M, 3) or (N, M, 4).
+        """
+        # QImage does not copy, so the data has to outlive it
+        self.data = np.ascontiguousarray(img, dtype=np.uint8)
+        channels = 1 if self.data.ndim == 2 else self.data.shape[2]
+        height, width = self.data.shape[:2]
+        self.qimage = QImage(self.data.data, width, height,
+                             self.data.strides[0], self.FORMATS[channels])
+        self.updatePixmap()
+
+    def updatePixmap(self):
+        if self.qimage is None:
+            return
+        self.setPixmap(QPixmap.fromImage(self.qimage).scaled(
+            self.size(), Qt.KeepAspectRatio, Qt.FastTransformation))
+
+    def resizeEvent(self, event):
+        super(PixelView, self).resizeEvent(event)
+        self.updatePixmap()
+
+    def mousePressEvent(self, event):
+        self.clicked.emit()
+
 
 class MyDoubleSpin(QDoubleSpinBox):
     def __init__(self, constant, parent=None):
@@ -33,15 +106,62 @@ class MyDoubleSpin(QDoubleSpinBox):
 
 class StandardMapTab(QWidget):
     """GUI class for the Standard map class.
+
+    All points are kept in one :class:`render.PointBuffer` that backs a single
+    scatter plot. New orbits are drawn on top of a saved background of the
+    axes and blitted, so the cost of adding an orbit does not depend on the
+    number of points already on screen. Matplotlib copies all points when
+    the scatter plot is updated, so it is only updated before full redraws.
+
+    Attributes:
+        points (PointBuffer): All plotted points with their colour index
+        orbits (int): Number of plotted orbits, used for the colour cycle
+        collection (PathCollection): Scatter plot of all points
+        newPoints (PathCollection): Animated scatter plot of the latest
+            orbits, only used for blitting
+        pointsChanged (bool): :attr:`collection` does not show all points
+            yet
+        background: Saved pixels of the axes with all points drawn
+        raster (DensityRaster): Histogram of all plotted points, shown
+            instead of the scatter plot in density mode
+        densityImage (AxesImage): Image of :attr:`raster`
+        chaosImage (AxesImage): Lyapunov exponents of a grid of seeds
+        store (OrbitStore): Session with all calculated orbits on disk
+
+    In density mode the points are only binned into :attr:`raster` and not
+    kept in :attr:`points`, so the memory stays constant for any number of
+    points. The raster is always filled, so switching to density mode shows
+    every orbit drawn so far.
     """
 
+    COLOURS = 10  # Length of the tab10 colour cycle
+    DENSITY_BINS = 512
+    SCATTER_LIMIT = 2000000  # Larger sessions are opened in density mode
+    STREAM_POINTS = 1000000  # Larger runs are drawn in chunks of this size
+
     def __init__(self, parent=None):
         super(StandardMapTab, self).__init__(parent)
         self.canvas = MplCanvas()
         self.canvas.mpl_connect('button_press_event', self.mousePress)
+        self.canvas.mpl_connect('draw_event', self.saveBackground)
+        self.canvas.beforeDraw.append(self.updateCollection)
         layout = QGridLayout()
         layout.addWidget(self.canvas, 0, 0, 1, -1)
         self.setLayout(layout)
+        self.runner = MapRunner(self)
+        self.points = PointBuffer()
+        self.orbits = 0
+        self.pointsChanged = False
+        self.background = None
+        self.raster = None
+        self.densityImage = None
+        self.chaosImage = None
+
+        options = dict(c=[], s=1.0, marker='.', linewidths=0, cmap='tab10',
+                       vmin=0, vmax=self.COLOURS)
+        self.collection = self.canvas.axes.scatter([], [], **options)
+        self.newPoints = self.canvas.axes.scatter([], [], animated=True,
+                                                  **options)
 
     def setMap(self, map):
         """Sets the map and perform UI setup.
@@ -49,6 +169,20 @@ class StandardMapTab(QWidget):
         logging.info('Setting map %s to StandardMapTab.', map.name)
         self.map = map
         self.updateLayout()
+        self.raster = DensityRaster(self.map.mod, self.DENSITY_BINS)
+        self.densityImage = self.canvas.axes.imshow(
+            self.raster.counts, origin='lower', interpolation='nearest',
+            extent=(0, self.map.mod, 0, self.map.mod), aspect='auto',
+            visible=False)
+        self.chaosImage = self.canvas.axes.imshow(
+            np.zeros((1, 1)), origin='lower', interpolation='nearest',
+            extent=(0, self.map.mod, 0, self.map.mod), aspect='auto',
+            cmap='inferno', visible=False)
+        self.canvas.axes.set_xlim(0, self.map.mod)
+        self.canvas.axes.set_ylim(0, self.map.mod)
+        self.canvas.fig.tight_layout()
+        self.store = OrbitStore(newSessionDir(self.map.name), self.map.name,
+                                self.map.mod)
 
     def updateLayout(self):
         """Adds additional widgets for interactiveness
@@ -71,6 +205,49 @@ class StandardMapTab(QWidget):
         clearPush.clicked.connect(self.clearPlot)
         layout.addWidget(clearPush, i + 1, 3)
 
+        savePush = QPushButton('Save session')
+        savePush.clicked.connect(self.saveSession)
+        openPush = QPushButton('Open session')
+        openPush.clicked.connect(self.openSession)
+        layout.addWidget(savePush, i + 1, 0)
+        layout.addWidget(openPush, i + 1, 1)
+
+        self.gridSize = QSpinBox()
+        self.gridSize.setMinimum(1)
+        self.gridSize.setMaximum(100)
+        self.gridSize.setValue(10)
+        fillPush = QPushButton('Fill phase space')
+        fillPush.clicked.connect(self.fillPhaseSpace)
+        layout.addWidget(QLabel('Seeds per axis'), i + 2, 0)
+        layout.addWidget(self.gridSize, i + 2, 1)
+        layout.addWidget(fillPush, i + 2, 3)
+
+        self.steps = QSpinBox()
+        self.steps.setMinimum(1)
+        self.steps.setMaximum(10**9)
+        self.steps.setValue(self.map.steps)
+        self.steps.valueChanged.connect(self.map.setSteps)
+        layout.addWidget(QLabel('Steps'), i + 5, 0)
+        layout.addWidget(self.steps, i + 5, 1)
+
+        chaosPush = QPushButton('Chaos map')
+        chaosPush.clicked.connect(self.chaosMap)
+        layout.addWidget(chaosPush, i + 3, 3)
+
+        self.backend = QComboBox()
+        self.backend.addItems(BACKENDS)
+        self.backend.setCurrentText(self.map.backend)
+        self.backend.currentTextChanged.connect(self.updateBackend)
+        layout.addWidget(QLabel('Backend'), i + 3, 0)
+        layout.addWidget(self.backend, i + 3, 1)
+
+        self.density = QCheckBox('Density')
+        self.density.toggled.connect(self.updateMode)
+        self.logScale = QCheckBox('Log scale')
+        self.logScale.toggled.connect(self.updateMode)
+        layout.addWidget(self.density, i + 4, 0)
+        layout.addWidget(self.logScale, i + 4, 1)
+
         group.setLayout(layout)
         self.layout().addWidget(group, 1, 0)
 
@@ -106,20 +283,261 @@ class StandardMapTab(QWidget):
                      constant, self.map.name, str(value))
         self.map.values[constant] = value
 
+    @pyqtSlot(str)
+    def updateBackend(self, backend):
+        """Selects the calculation backend of the map. Shows the backend that
+        is actually active, in case the selected one is not available.
+        """
+        self.map.setBackend(backend)
+        if self.map.backend != backend:
+            self.backend.setCurrentText(self.map.backend)
+
+    # Without the slot signature the checked argument of clicked would be
+    # passed on by the timing wrapper
+    @pyqtSlot()
+    @timed('StandardMapTab.clearPlot')
     def clearPlot(self):
-        """Clears the plot.
+        """Clears the plot and starts a new session. The orbits of the old
+        session stay on disk and can be opened again.
         """
-        self.canvas.axes.cla()
+        # Running calculations still append to the store they were given
+        self.runner.cancel()
+        self.store = OrbitStore(newSessionDir(self.map.name),
+                                self.map.name, self.map.mod)
+        self.points.clear()
+        self.raster.clear()
+        self.orbits = 0
+        self.pointsChanged = True
+        self.newPoints.set_offsets(self.points.offsets())
+        self.newPoints.set_array(self.points.colours())
+        self.updateDensity()
+        self.chaosImage.set_visible(False)
         self.canvas.draw()
 
+    @pyqtSlot(bool)
+    def updateMode(self, checked):
+        """Switches between the scatter plot and the density raster.
+        """
+        density = self.density.isChecked()
+        logging.info('Density mode for %s: %s', self.map.name, density)
+        self.collection.set_visible(not density)
+        self.densityImage.set_visible(density)
+        self.chaosImage.set_visible(False)
+        self.updateDensity()
+        self.canvas.draw_idle()
+
+    def chaosMap(self):
+        """Colours a grid of seeds by their finite-time Lyapunov exponent.
+        The size of the grid is read from :attr:`gridSize`.
+        """
+        n = self.gridSize.value()
+        logging.info('Calculating chaos map of %s with %d seeds',
+                     self.map.name, n * n)
+        q0, p0 = self.map.seedGrid(n)
+        self.runner.submit(self.showChaosMap, self.map.lyapunov, q0, p0)
+
+    def showChaosMap(self, exponents):
+        n = int(round(np.sqrt(exponents.size)))
+        exponents = exponents.reshape(n, n)
+        self.chaosImage.set_data(exponents)
+        self.chaosImage.set_clim(0, max(exponents.max(), 1e-6))
+        self.chaosImage.set_visible(True)
+        self.collection.set_visible(False)
+        self.densityImage.set_visible(False)
+        self.canvas.draw_idle()
+
+    def updateDensity(self):
+        """Updates the image of the density raster and its colour scale.
+        """
+        counts = self.raster.counts
+        vmax = max(counts.max(), 1)
+        if self.logScale.isChecked():
+            norm = LogNorm(vmin=1, vmax=max(vmax, 2))
+        else:
+            norm = Normalize(vmin=0, vmax=vmax)
+        self.densityImage.set_data(counts)
+        self.densityImage.set_norm(norm)
+
+    def updateCollection(self):
+        """Hands all points to the scatter plot if they changed since the
+        last full redraw.
+        """
+        if self.pointsChanged:
+            self.collection.set_offsets(self.points.offsets())
+            self.collection.set_array(self.points.colours())
+            self.pointsChanged = False
+
+    def saveBackground(self, event):
+        """Saves the axes with all points after every full redraw.
+        """
+        self.background = self.canvas.copy_from_bbox(self.canvas.axes.bbox)
+
+    def fillPhaseSpace(self):
+        """Draws the orbits of a grid of seeds spread over the whole phase
+        space. The size of the grid is read from :attr:`gridSize`.
+        """
+        n = self.gridSize.value()
+        logging.info('Filling phase space of %s with %d seeds',
+                     self.map.name, n * n)
+        self.submit(*self.map.seedGrid(n))
+
+    def calculate(self, q0, p0, steps, store):
+        """Calculates the orbits and appends them to the session store, i.e.,
+        the one of the time of the request. Runs on the worker thread.
+        """
+        q, p = self.map.mapBatch(q0, p0, steps)
+        store.append(q, p, {c: self.map.values[c]
+                            for c in self.map.constants})
+        return q, p
+
+    def calculateStream(self, q0, p0, steps, store):
+        """Generator version of :meth:`calculate`, every chunk is appended
+        to the session store on its own.
+
+        Yields:
+            tuple: Index of the chunk and the arrays q, p of the chunk
+        """
+        constants = {c: self.map.values[c] for c in self.map.constants}
+        chunks = self.map.mapStream(q0, p0, steps, self.STREAM_POINTS)
+        for index, (q, p) in enumerate(chunks):
+            store.append(q, p, constants)
+            yield index, (q, p)
+
+    def plotChunk(self, chunk):
+        """Plots one chunk of :meth:`calculateStream`, the chunks after the
+        first continue the orbits of the first one.
+        """
+        index, orbits = chunk
+        self.plot(orbits, index > 0)
+
     def draw(self):
-        """Draws the new path from the map.
+        """Draws the new path from the map. The path is calculated on the
+        worker thread and plotted once it is done.
         """
-        x, y = self.map.map()
-        self.canvas.axes.plot(x, y, '.', ms=1.0)
-        self.canvas.axes.set_xlim(0, self.map.mod)
-        self.canvas.axes.set_ylim(0, self.map.mod)
-        self.canvas.fig.tight_layout()
+        self.submit(self.map.values['q'], self.map.values['p'])
+
+    def submit(self, q0, p0):
+        """Calculates the orbits of the seeds with the number of steps of
+        :attr:`steps` on the worker thread. Runs of more points than
+        :attr:`STREAM_POINTS` in all orbits are streamed and drawn chunk by
+        chunk while they are calculated.
+        """
+        steps = self.steps.value()
+        if np.size(q0) * steps > self.STREAM_POINTS:
+            self.runner.submitStream(self.plotChunk, self.calculateStream,
+                                     q0, p0, steps, self.store)
+        else:
+            self.runner.submit(self.plot, self.calculate, q0, p0, steps,
+                               self.store)
+
+    def addOrbits(self, x, y, continued=False):
+        """Adds orbits to the density raster and, unless in density mode, to
+        the point buffer. Every orbit gets the next colour of the colour
+        cycle.
+
+        Arguments:
+            x (ndarray): q values of shape (M, steps)
+            y (ndarray): p values of shape (M, steps)
+            continued (bool): The points continue the last M orbits, so
+                they keep their colours
+
+        Returns:
+            slice: Position of the new points in :attr:`points`, None in
+            density mode
+        """
+        number, steps = x.shape
+        if continued:
+            self.orbits -= number
+        colours = (self.orbits + np.arange(number)) % self.COLOURS + 0.5
+        self.orbits += number
+        self.raster.add(x, y)
+        if self.density.isChecked():
+            return None
+        return self.points.append(x, y, np.repeat(colours, steps))
+
+    @timed('StandardMapTab.plot', lambda self, orbits, *args: orbits[0].size)
+    def plot(self, orbits, continued=False):
+        """Plots the orbits.
+
+        Arguments:
+            orbits (tuple): Arrays q, p of shape (M, steps) as returned by
+                :meth:`maps.StandardMap.mapBatch`
+            continued (bool): See :meth:`addOrbits`
+        """
+        x, y = orbits
+        new = self.addOrbits(x, y, continued)
+
+        if self.chaosImage.get_visible():
+            self.updateMode(False)
+
+        if new is None:
+            self.updateDensity()
+            self.canvas.draw_idle()
+            return
+
+        # The points are already in the saved background after blitting,
+        # the scatter plot gets them with the next full redraw
+        self.pointsChanged = True
+
+        if self.background is None or not self.canvas.supports_blit:
+            self.canvas.draw_idle()
+            return
+
+        self.newPoints.set_offsets(self.points.offsets(new))
+        self.newPoints.set_array(self.points.colours(new))
+        self.canvas.restore_region(self.background)
+        self.canvas.axes.draw_artist(self.newPoints)
+        self.canvas.blit(self.canvas.axes.bbox)
+        self.background = self.canvas.copy_from_bbox(self.canvas.axes.bbox)
+
+    def saveSession(self):
+        """Exports all orbits of the session into one .npz archive. The
+        export runs on the worker thread after the pending calculations.
+        """
+        fileName, _ = QFileDialog.getSaveFileName(
+            self, 'Save session', '%s.npz' % self.map.name,
+            'Session archive (*.npz)')
+        if not fileName:
+            return
+        self.runner.submit(self.sessionSaved, self.store.export, fileName)
+
+    def sessionSaved(self, result):
+        logging.info('Session of %s saved', self.map.name)
+
+    def openSession(self):
+        """Shows the orbits of a session directory (its meta.json) or of an
+        exported archive, without calculating them again. Large sessions
+        are shown in density mode.
+        """
+        fileName, _ = QFileDialog.getOpenFileName(
+            self, 'Open session', os.path.expanduser(SESSION_DIR),
+            'Sessions (meta.json *.npz)')
+        if not fileName:
+            return
+        path = fileName
+        if os.path.basename(fileName) == OrbitStore.META:
+            path = os.path.dirname(fileName)
+
+        meta, orbits = readOrbits(path)
+        if meta['map'] != self.map.name:
+            logging.warning('Session %s is of map "%s", not "%s"', path,
+                            meta['map'], self.map.name)
+        points = sum(c['orbits'] * c['steps'] for c in meta['chunks'])
+        logging.info('Opening session %s with %d points', path, points)
+
+        self.clearPlot()
+        if os.path.isdir(path):
+            self.store = OrbitStore(path)  # Continue the session
+        if points > self.SCATTER_LIMIT and not self.density.isChecked():
+            self.density.setChecked(True)
+
+        for chunk, (q, p) in zip(meta['chunks'], orbits):
+            self.addOrbits(q, p)
+            if not os.path.isdir(path):
+                self.store.append(q, p, chunk['constants'])
+
+        self.pointsChanged = True
+        self.updateDensity()
         self.canvas.draw()
 
 
@@ -129,18 +547,33 @@ class ImageMapTab(QWidget):
 
     Attributes:
         map (Map): Map object
+        axesImage (AxesImage): Persistent image artist, of which only the
+            data is updated on every frame
+        pixelView (PixelView): Direct rendering without matplotlib
+        view (QStackedWidget): Shows either the canvas or the pixel view
+        image (ndarray): The drawn image. Never a working buffer of the map,
+            so it stays valid while the map iterates
     """
     def __init__(self, parent=None):
         super(ImageMapTab, self).__init__(parent)
         self.canvas = MplCanvas()
         self.canvas.mpl_connect('button_press_event', self.mousePress)
+        self.axesImage = None
+        self.pixelView = PixelView()
+        self.pixelView.clicked.connect(self.performIteration)
+        self.view = QStackedWidget()
+        self.view.addWidget(self.canvas)
+        self.view.addWidget(self.pixelView)
         layout = QGridLayout()
-        layout.addWidget(self.canvas, 0, 0, 1, -1)
+        layout.addWidget(self.view, 0, 0, 1, -1)
         self.setLayout(layout)
         self.AUTO_ITERATING = 0
         self.autoTimer = QTimer()
         self.autoTimer.timeout.connect(self.performIteration)
         self.iteration = 0
+        self.runner = MapRunner(self)
+        self.exportCancel = threading.Event()
+        self.image = None
 
     def setMap(self, map):
         """Sets the map object and perform other UI setup.
@@ -148,7 +581,39 @@ class ImageMapTab(QWidget):
         logging.info('Setting map %s to ImageMapTab.', map.name)
         self.map = map
         self.updateLayout()
-        self.draw(self.map.baseImage)
+        if self.map.baseImage is None:
+            # Decoding in the background, the tab is usable once it is done
+            self.setEnabled(False)
+            self.sizeLabel.setText('Loading...')
+            self.runner.submit(self.imageLoaded, self.map.loadImage,
+                               error=self.loadFailed)
+        else:
+            self.draw(self.map.baseImage)
+
+    def imageLoaded(self, img):
+        """Draws the image once it is decoded and enables the controls.
+        """
+        self.showSize(img)
+        self.setEnabled(True)
+        self.draw(img)
+
+    def loadFailed(self, exception):
+        """Shows why the image could not be loaded. The controls stay
+        disabled, as there is no image to work on.
+        """
+        logging.error('Could not load the image of %s: %s', self.map.name,
+                      exception)
+        self.sizeLabel.setText('Loading failed: %s' % exception)
+
+    def showSize(self, img):
+        """Shows the dimension of the image, N for square images and NxM
+        otherwise.
+        """
+        rows, columns = img.shape[:2]
+        if rows == columns:
+            self.sizeLabel.setNum(rows)
+        else:
+            self.sizeLabel.setText('%dx%d' % (rows, columns))
 
     def updateLayout(self):
         """Fills the user interfaces with control widgets.
@@ -156,29 +621,80 @@ class ImageMapTab(QWidget):
         Attributes:
             timer (QPushButton): Starts the QTimer to start map iteration
             resize (QSpinBox): Holds the resize value for resizing the image
+            resizeFilter (QComboBox): Filter used for resizing
             sizeLabel (QLabel): Current image dimension
+            goTo (QSpinBox): Holds the iteration to jump to
+            periodLabel (QLabel): Period of the map for the current size
+            interval (QSpinBox): Auto iteration interval in milliseconds
+            direct (QCheckBox): Draws with :class:`PixelView` if checked
+            exportCount (QSpinBox): Number of iterations to export
+            exportFormat (QComboBox): Format of the export
+            exportLabel (QLabel): State of the export
         """
         self.timer = QPushButton('Auto iterate')
         self.timer.clicked.connect(self.setAutoMap)
 
+        self.interval = QSpinBox()
+        self.interval.setMinimum(10)
+        self.interval.setMaximum(10000)
+        self.interval.setValue(1000)
+        self.interval.setSuffix(' ms')
+        self.interval.valueChanged.connect(self.autoTimer.setInterval)
+
+        self.direct = QCheckBox('Direct rendering')
+        self.direct.toggled.connect(self.setDirectRendering)
+
         reset = QPushButton('Reset')
         reset.clicked.connect(self.reset)
 
         self.resize = QSpinBox()
         self.resize.setMinimum(10)
-        self.resize.setMaximum(1000)
+        self.resize.setMaximum(4096)
+
+        self.resizeFilter = QComboBox()
+        self.resizeFilter.addItems(RESIZE_FILTERS)
+        self.resizeFilter.setCurrentText(self.map.resizeFilter)
+        self.resizeFilter.currentTextChanged.connect(self.map.setResizeFilter)
 
         resizePush = QPushButton('Resize')
         resizePush.clicked.connect(self.resizeImage)
 
         sizeLabel = QLabel('Size: ')
         self.sizeLabel = QLabel()
-        self.sizeLabel.setNum(self.map.image.shape[0])
+        if self.map.image is not None:
+            self.showSize(self.map.image)
         iterationLabel = QLabel('Iteration: ')
         self.iterationLabel = QLabel()
         self.iterationLabel.setNum(self.iteration)
 
-        self.layout().addWidget(self.timer, 1, 0, 1, -1)
+        self.goTo = QSpinBox()
+        self.goTo.setMinimum(0)
+        self.goTo.setMaximum(10**9)
+
+        goToPush = QPushButton('Go to iteration')
+        goToPush.clicked.connect(self.goToIteration)
+
+        periodPush = QPushButton('Find period')
+        periodPush.clicked.connect(self.findPeriod)
+        periodLabel = QLabel('Period: ')
+        self.periodLabel = QLabel()
+
+        self.exportCount = QSpinBox()
+        self.exportCount.setMinimum(1)
+        self.exportCount.setMaximum(10**6)
+        self.exportCount.setValue(100)
+        self.exportCount.setSuffix(' iterations')
+
+        self.exportFormat = QComboBox()
+        self.exportFormat.addItems(EXPORT_FORMATS)
+
+        exportPush = QPushButton('Export')
+        exportPush.clicked.connect(self.exportAnimation)
+        self.exportLabel = QLabel()
+
+        self.layout().addWidget(self.timer, 1, 0, 1, 4)
+        self.layout().addWidget(self.interval, 1, 4)
+        self.layout().addWidget(self.direct, 1, 5)
         self.layout().addWidget(reset, 2, 0, 1, -1)
         self.layout().addWidget(self.resize, 3, 0)
         self.layout().addWidget(resizePush, 3, 1)
@@ -186,26 +702,164 @@ class ImageMapTab(QWidget):
         self.layout().addWidget(self.sizeLabel, 3, 3)
         self.layout().addWidget(iterationLabel, 3, 4)
         self.layout().addWidget(self.iterationLabel, 3, 5)
+        self.layout().addWidget(self.goTo, 4, 0)
+        self.layout().addWidget(goToPush, 4, 1)
+        self.layout().addWidget(periodPush, 4, 2)
+        self.layout().addWidget(periodLabel, 4, 3)
+        self.layout().addWidget(self.periodLabel, 4, 4)
+        self.layout().addWidget(self.resizeFilter, 4, 5)
+        self.layout().addWidget(self.exportCount, 5, 0)
+        self.layout().addWidget(self.exportFormat, 5, 1)
+        self.layout().addWidget(exportPush, 5, 2)
+        self.layout().addWidget(self.exportLabel, 5, 3, 1, -1)
 
     def drawImage(self):
         pass
 
+    def advance(self, target=None):
+        """Brings the map to the target iteration. Runs on the worker thread,
+        which is the only place where :attr:`iteration` changes while
+        calculations are running.
+
+        Arguments:
+            target (int): Iteration to jump to. None for the next iteration.
+
+        Returns:
+            tuple: A copy of the image and its iteration. The map reuses its
+            working buffers, so the next iterations could otherwise change
+            the image while it is drawn.
+        """
+        if target is None:
+            self.map.map()
+            self.iteration += 1
+        else:
+            self.map.iterate(target - self.iteration)
+            self.iteration = target
+        return self.map.image.copy(), self.iteration
+
+    def restart(self, change, *args):
+        """Changes the image of the map with change(*args), e.g., a reset,
+        and starts counting the iterations again. Runs on the worker thread
+        after the running job, so the map never changes during a
+        calculation.
+
+        Returns:
+            tuple: The new image and iteration 0
+        """
+        change(*args)
+        self.iteration = 0
+        # The image is the original or a cached resized one, which are never
+        # changed, so it needs no copy
+        return self.map.image, self.iteration
+
+    def showIteration(self, result):
+        """Draws the image of the iteration calculated by :meth:`advance`.
+        """
+        img, iteration = result
+        self.draw(img)
+        self.iterationLabel.setNum(iteration)
+
+    def showRestart(self, result):
+        """Shows the new image of :meth:`restart`.
+        """
+        self.showSize(result[0])
+        self.showIteration(result)
+
     @pyqtSlot()
     def performIteration(self):
         logging.info('Performing iteration for %s', self.map.name)
-        self.map.map()
-        self.draw(self.map.image)
-        self.iteration += 1
-        self.iterationLabel.setNum(self.iteration)
+        # Only the latest frame matters, so waiting frames are dropped
+        self.runner.submit(self.showIteration, self.advance, coalesce=True)
+
+    def goToIteration(self):
+        """Jumps directly to the iteration set in :attr:`goTo` QSpinBox.
+        """
+        value = self.goTo.value()
+        logging.info('Jumping to iteration %d for %s', value, self.map.name)
+        self.runner.submit(self.showIteration, self.advance, value)
+
+    def findPeriod(self):
+        """Calculates the period of the map for the current image size. Once
+        known, jumps only perform the phase within the period.
+        """
+        self.runner.submit(self.showPeriod, self.map.period)
+
+    def showPeriod(self, period):
+        logging.info('Period of %s is %d', self.map.name, period)
+        self.periodLabel.setNum(period)
+
+    def exportAnimation(self):
+        """Exports the next iterations, starting at the current one, on the
+        worker thread. The frame rate of the animation follows the auto
+        iteration interval.
+        """
+        format = self.exportFormat.currentText()
+        if format == 'png':
+            output = QFileDialog.getExistingDirectory(self, 'Export frames')
+        else:
+            extension = 'gif' if format == 'gif' else 'png'
+            output, _ = QFileDialog.getSaveFileName(
+                self, 'Export animation', '%s.%s' % (self.map.name, extension),
+                '%s (*.%s)' % (format.upper(), extension))
+        if not output:
+            return
 
+        count = self.exportCount.value()
+        logging.info('Exporting %d iterations of %s to %s', count,
+                     self.map.name, output)
+        # The frames are generated on the worker thread, so they start at the
+        # iteration the map has when the export runs
+        frames = ((self.iteration + i, img)
+                  for i, img in self.map.frames(count))
+        # A new event, so an export that is still stopping stays cancelled
+        self.exportCancel = threading.Event()
+        self.exportLabel.setText('Exporting...')
+        self.runner.submit(self.exported, exportFrames, frames, output,
+                           format, 1000.0 / self.interval.value(), count + 1,
+                           None, None, None, self.exportCancel)
+
+    def exported(self, count):
+        self.exportLabel.setText('Exported %d frames' % count)
+
+    @timed('ImageMapTab.draw', lambda self, img: img.shape[0] * img.shape[1])
     def draw(self, img):
+        """Draws the image. The image artist and the layout are only created
+        when the shape of the image changes, otherwise only the data of the
+        artist is replaced and the axes are blitted.
+        """
         logging.info('Drawing image for %s', self.map.name)
-        self.canvas.axes.cla()
-        self.canvas.axes.imshow(img)
-        self.canvas.axes.axis('off')
-        self.canvas.fig.tight_layout()
+        self.image = img
+        if self.direct.isChecked():
+            self.pixelView.setImage(img)
+            return
 
-        self.canvas.draw()
+        if self.axesImage is None or \
+                self.axesImage.get_array().shape != img.shape:
+            self.canvas.axes.cla()
+            self.axesImage = self.canvas.axes.imshow(img,
+                                                     interpolation='nearest')
+            self.canvas.axes.axis('off')
+            self.canvas.fig.tight_layout()
+            self.canvas.draw()
+            return
+
+        self.axesImage.set_data(img)
+        if self.canvas.supports_blit:
+            self.canvas.axes.draw_artist(self.axesImage)
+            self.canvas.blit(self.canvas.axes.bbox)
+        else:
+            self.canvas.draw_idle()
+
+    @pyqtSlot(bool)
+    def setDirectRendering(self, direct):
+        """Switches between the matplotlib canvas and the direct
+        :class:`PixelView`.
+        """
+        logging.info('Direct rendering for %s: %s', self.map.name, direct)
+        self.view.setCurrentWidget(self.pixelView if direct else self.canvas)
+        self.axesImage = None  # Canvas is redrawn fully when shown again
+        if self.image is not None:
+            self.draw(self.image)
 
     def mousePress(self, e):
         """Manually starts the next iteration.
@@ -220,32 +874,116 @@ class ImageMapTab(QWidget):
             self.timer.setText('Auto iterate')
             self.AUTO_ITERATING = 0
             self.autoTimer.stop()
+            # Only the waiting frames, a running export goes on
+            self.runner.cancelCoalesced()
             return
         logging.info('Auto iteration started')
         self.AUTO_ITERATING = 1
-        self.autoTimer.start(1000)
+        self.autoTimer.start(self.interval.value())
         self.timer.setText('Stop iteration')
 
     def reset(self):
         """Reset to original figure
         """
         logging.info('Reseting to original image for map %s', self.map.name)
-        self.map.reset()
-        self.sizeLabel.setNum(self.map.image.shape[0])
-        self.draw(self.map.image)
-
-        self.iteration = 0
-        self.iterationLabel.setNum(0)
+        self.exportCancel.set()
+        self.runner.cancel()
+        self.periodLabel.clear()
+        self.exportLabel.clear()
+        self.runner.submit(self.showRestart, self.restart, self.map.reset)
 
     def resizeImage(self):
-        """Resizes the original image to a new image and draws it immediately.
-        The new size value is received from :attr:`resize` QSpinBox.
+        """Resizes the original image to a new image and draws it once it is
+        resized. The new size value is received from :attr:`resize` QSpinBox.
         """
         logging.info('Resizing image for map %s', self.map.name)
 
         value = self.resize.value()
 
-        self.map.resize(value)
-        self.sizeLabel.setNum(self.map.image.shape[0])
-        self.draw(self.map.image)
-        self.iterationLabel.setNum(0)
+        self.exportCancel.set()
+        self.runner.cancel()
+        self.periodLabel.clear()
+        self.exportLabel.clear()
+        self.runner.submit(self.showRestart, self.restart, self.map.resize,
+                           value)
+
+
+class MetricsTab(QWidget):
+    """Shows the rolling statistics of the measured spans, see
+    :mod:`metrics`, and switches profiling on and off.
+
+    The refresh timer also measures how late it fires, which is recorded as
+    the span Qt.timerDelay. A large delay means that the event loop is busy,
+    i.e., the user interface is sluggish.
+
+    Attributes:
+        table (QTableWidget): One row of statistics per span
+        profile (QPushButton): Starts and stops profiling
+        timer (QTimer): Refreshes the table
+    """
+
+    INTERVAL = 500  # Refresh interval in milliseconds
+    COLUMNS = ('Span', 'Calls', 'p50 (ms)', 'p95 (ms)', 'Work/s')
+
+    def __init__(self, parent=None):
+        super(MetricsTab, self).__init__(parent)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.ResizeToContents)
+        self.table.verticalHeader().hide()
+
+        clear = QPushButton('Clear')
+        clear.clicked.connect(METRICS.clear)
+
+        self.profile = QPushButton('Start profiling')
+        self.profile.setCheckable(True)
+        self.profile.toggled.connect(self.setProfiling)
+
+        layout = QGridLayout()
+        layout.addWidget(self.table, 0, 0, 1, -1)
+        layout.addWidget(clear, 1, 0)
+        layout.addWidget(self.profile, 1, 1)
+        self.setLayout(layout)
+
+        self.last = time.perf_counter()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(self.INTERVAL)
+
+    @pyqtSlot()
+    def refresh(self):
+        now = time.perf_counter()
+        METRICS.record('Qt.timerDelay',
+                       max(now - self.last - self.INTERVAL / 1000, 0.0))
+        self.last = now
+        if not self.isVisible():
+            return
+
+        statistics = METRICS.statistics()
+        self.table.setRowCount(len(statistics))
+        for row, (name, values) in enumerate(statistics.items()):
+            rate = '%.3g' % values['rate'] if values['rate'] else ''
+            items = (name, '%d' % values['count'],
+                     '%.2f' % (1000 * values['p50']),
+                     '%.2f' % (1000 * values['p95']), rate)
+            for column, text in enumerate(items):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+
+    @pyqtSlot(bool)
+    def setProfiling(self, profiling):
+        """Starts profiling or stops it and asks where to save the profile.
+        """
+        if profiling:
+            logging.info('Profiling started')
+            PROFILER.start()
+            self.profile.setText('Stop profiling')
+            return
+
+        stats = PROFILER.stop()
+        self.profile.setText('Start profiling')
+        fileName, _ = QFileDialog.getSaveFileName(
+            self, 'Save profile', 'profile.prof', 'cProfile (*.prof)')
+        if fileName:
+            stats.dump_stats(fileName)
+            logging.info('Profile saved to %s', fileName)
@@ -0,0 +1,202 @@
+"""Module that runs map calculations outside of the Qt main thread, so the
+user interface never freezes while a map is calculating.
+"""
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+import logging
+import threading
+
+from src.metrics import PROFILER
+
+STREAM_QUEUE = 4  # Chunks of a stream that wait for the main thread
+
+
+class JobSignals(QObject):
+    """Signals of a :class:`Job`. QRunnable is not a QObject, so it can not
+    emit signals itself.
+
+    Attributes:
+        room (threading.Semaphore): Number of further chunks a stream may
+            emit before the main thread has handled the previous ones
+    """
+    finished = pyqtSignal(int, bool, object)
+    chunk = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super(JobSignals, self).__init__(parent)
+        self.room = threading.Semaphore(STREAM_QUEUE)
+
+
+class Job(QRunnable):
+    """One calculation, i.e., a function and its arguments.
+
+    Attributes:
+        runner (MapRunner): Runner that submitted the job
+        jobId (int): Increasing number of the job inside the runner
+        signals (JobSignals): Signals for returning the result
+        stream (bool): The function is a generator, whose items are
+            returned one by one as they are calculated
+        coalesce (bool): The job is dropped if a newer coalescing job is
+            submitted before it starts
+    """
+
+    def __init__(self, runner, jobId, function, args, stream=False,
+                 coalesce=False):
+        super(Job, self).__init__()
+        self.runner = runner
+        self.jobId = jobId
+        self.function = function
+        self.args = args
+        self.stream = stream
+        self.coalesce = coalesce
+        self.signals = JobSignals()
+
+    def cancelled(self):
+        return self.runner.isCancelled(self.jobId, self.coalesce)
+
+    def run(self):
+        # Newer request arrived before this one started or it was cancelled
+        if (self.coalesce and self.jobId != self.runner.coalescedId) or \
+                self.cancelled():
+            self.signals.finished.emit(self.jobId, False, None)
+            return
+
+        try:
+            if self.stream:
+                result = PROFILER.profile(self.runStream)
+            else:
+                result = PROFILER.profile(self.function, *self.args)
+        except Exception as e:
+            logging.error('Calculation failed: %s', e)
+            self.signals.finished.emit(self.jobId, False, e)
+            return
+        self.signals.finished.emit(self.jobId, True, result)
+
+    def runStream(self):
+        """Emits the items of the generator until it is exhausted or the job
+        is cancelled. At most :data:`STREAM_QUEUE` items wait for the main
+        thread, so a fast generator does not fill the memory.
+
+        Returns:
+            int: Number of emitted items
+        """
+        emitted = 0
+        for item in self.function(*self.args):
+            while not self.signals.room.acquire(timeout=0.05):
+                if self.cancelled():
+                    return emitted
+            if self.cancelled():
+                return emitted
+            self.signals.chunk.emit(self.jobId, item)
+            emitted += 1
+        return emitted
+
+
+class MapRunner(QObject):
+    """Runs the calculations of one map on a single worker thread, so the
+    calculations of one map never run concurrently.
+
+    Requests run in the order they are submitted. Requests that supersede
+    each other, e.g., the next frame of an animation, can be coalesced: if a
+    newer coalescing request is submitted before the previous one started,
+    the previous one is dropped. A request that is already running always
+    finishes, but its result is only delivered if it was not cancelled.
+    Streams are the exception, they stop at the next item when cancelled.
+
+    Attributes:
+        pool (QThreadPool): Thread pool with a single thread
+        latestId (int): Id of the latest submitted job
+        coalescedId (int): Id of the latest submitted coalescing job
+        cancelledId (int): Jobs up to this id are cancelled
+        coalescedCancelledId (int): Coalescing jobs up to this id are
+            cancelled
+        callbacks (dict): Callbacks of the pending jobs, called in the main
+            thread with the result, their signals, if they are streams and
+            if they coalesce
+        errors (dict): Callbacks of the pending jobs that are called in the
+            main thread with the exception if the job fails
+    """
+
+    def __init__(self, parent=None):
+        super(MapRunner, self).__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.latestId = 0
+        self.coalescedId = 0
+        self.cancelledId = 0
+        self.coalescedCancelledId = 0
+        self.callbacks = {}
+        self.errors = {}
+
+    def submit(self, callback, function, *args, coalesce=False, error=None):
+        """Calculates function(*args) on the worker thread and afterwards
+        calls callback(result) in the main thread. With coalesce, the job
+        replaces the previous coalescing job if that did not start yet. If
+        the function raises an exception, error(exception) is called in the
+        main thread instead.
+        """
+        self.start(Job(self, self.latestId + 1, function, args,
+                       coalesce=coalesce), callback, error)
+
+    def submitStream(self, callback, function, *args):
+        """Iterates the generator function(*args) on the worker thread and
+        calls callback(item) in the main thread for every item, as soon as
+        it is calculated. A running stream stops when it is cancelled.
+        """
+        job = Job(self, self.latestId + 1, function, args, stream=True)
+        job.signals.chunk.connect(self.finishChunk)
+        self.start(job, callback)
+
+    def start(self, job, callback, error=None):
+        self.latestId = job.jobId
+        if job.coalesce:
+            self.coalescedId = job.jobId
+        job.signals.finished.connect(self.finish)
+        self.callbacks[job.jobId] = (callback, job.signals, job.stream,
+                                     job.coalesce)
+        if error is not None:
+            self.errors[job.jobId] = error
+        self.pool.start(job)
+
+    def cancel(self):
+        """Cancels all submitted jobs. The running one is not waited for, so
+        the main thread never blocks. Changes of the map are submitted as
+        jobs themselves instead, which run after the running one.
+        """
+        self.cancelledId = self.latestId
+
+    def cancelCoalesced(self):
+        """Cancels the submitted coalescing jobs, e.g., the waiting frames of
+        an animation, but none of the other jobs.
+        """
+        self.coalescedCancelledId = self.coalescedId
+
+    def isCancelled(self, jobId, coalesce=False):
+        return jobId <= self.cancelledId or (
+            coalesce and jobId <= self.coalescedCancelledId)
+
+    @pyqtSlot(int, bool, object)
+    def finish(self, jobId, success, result):
+        callback, _, stream, coalesce = self.callbacks.pop(
+            jobId, (None, None, False, False))
+        error = self.errors.pop(jobId, None)
+        if stream or self.isCancelled(jobId, coalesce):
+            return  # Items of streams were already delivered by finishChunk
+        if not success:
+            # Jobs that were dropped before they started have no exception
+            if error is not None and result is not None:
+                error(result)
+            return
+        if callback is not None:
+            callback(result)
+
+    @pyqtSlot(int, object)
+    def finishChunk(self, jobId, item):
+        callback, signals, _, _ = self.callbacks.get(
+            jobId, (None, None, False, False))
+        if callback is None:
+            return
+        if not self.isCancelled(jobId):
+            callback(item)
+        signals.room.release()